@@ -1,11 +1,46 @@
 #!/usr/bin/env python3
-from pathlib import Path; import concat_sources_lib as c; OUTPUT_FILENAME = "concatenated_MVR.txt"; SECONDARY_OUTPUT_PATH = Path("/Users/nata/Desktop/temp/concatenated.txt"); OUTPUT_FILENAME_temp = "concatenated_MVR_temp.txt"; SECONDARY_OUTPUT_PATH_temp = Path("/Users/nata/Desktop/temp/concatenated_temp.txt")
+from __future__ import annotations
+
+import os
+import sys
+import time
+from importlib.util import LazyLoader, find_spec, module_from_spec
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import argparse
+
+
+def _lazy_import(name: str):
+    """Import name on first attribute access, so quick commands never pay for it."""
+    spec = find_spec(name)
+    spec.loader = LazyLoader(spec.loader)
+    module = sys.modules[name] = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+from pathlib import Path; c = _lazy_import("concat_sources_lib"); OUTPUT_FILENAME = "concatenated_MVR.txt"; SECONDARY_OUTPUT_PATH = Path("/Users/nata/Desktop/temp/concatenated.txt"); OUTPUT_FILENAME_temp = "concatenated_MVR_temp.txt"; SECONDARY_OUTPUT_PATH_temp = Path("/Users/nata/Desktop/temp/concatenated_temp.txt")
 
 # # Relative paths of files to concatenate 
 SOURCE_FILES_TEMP = [
 
 ]
 
+# Optional priorities for --max-tokens (higher is kept first; unlisted entries are 0).
+# With no priorities the budget is filled in manifest order.
+SOURCE_PRIORITIES = {
+
+}
+
+# Entries may also be globs ("AnimLibS/Brain/**/*.swift"); their matches are sorted,
+# and these fnmatch patterns drop matches by relative path or file name.
+# A directory entry can shape its listing: "AssetsToImport.bundle#depth=2,rollup,include=*.usdz"
+# (options: depth=N, max=N, include=<glob>, exclude=<glob>, rollup).
+SOURCE_EXCLUDES = [
+    "*/.DS_Store",
+]
+
 
 
 SOURCE_FILES = [
@@ -13,13 +48,13 @@ SOURCE_FILES = [
     # ============================================================================
     # Project Structure
     # ============================================================================
-    "_concat/project_structure-MatheMagicApp.text",
-    "_concat/project_structure-AILib.text",
-    "_concat/project_structure-AnimLib.text",
-    # "_concat/project_structure-AssetLib.text",
-    "_concat/project_structure-CoreLib.text",
-    "_concat/project_structure-Inertialization.text",
-    # "_concat/project_structure-joystickController.text",
+    "structure:MatheMagicApp",
+    "structure:AILibS",
+    "structure:AnimLibS",
+    # "structure:AssetLibS",
+    "structure:CoreLibS",
+    "structure:InertializationS",
+    # "structure:joystickControllerS",
 
     # ============================================================================
     # APP (MatheMagicApp)
@@ -169,6 +204,7 @@ SOURCE_FILES = [
     #----------------------------------------------------------------------------
     # ANIMATION: Transitions
     #----------------------------------------------------------------------------
+    # "AnimLibS/AnimationTranstions/**/*.swift",
 
     #----------------------------------------------------------------------------
     # ANIMATION: Transitions / Construct Poses / 0-Pose-Level
@@ -379,8 +415,442 @@ SOURCE_FILES = [
     "joystickControllerS/UI/JoystickController.swift",
 ]
 
+
+
+DEFAULT_MANIFEST = Path(__file__).resolve().parent / "concat_manifest.toml"
+
+
+def listed_sources(args: argparse.Namespace, resolver: c.SourceResolver) -> set[str]:
+    """Cache keys of every file in SOURCE_FILES, SOURCE_FILES_TEMP or any manifest target.
+
+    Pruning against these keeps the cache entries of bundles this run did not build.
+    """
+    entry_lists = [(SOURCE_FILES, SOURCE_EXCLUDES), (globals().get("SOURCE_FILES_TEMP") or [], SOURCE_EXCLUDES)]
+    for manifest in {path.resolve() for path in (args.manifest, DEFAULT_MANIFEST) if path is not None and path.exists()}:
+        entry_lists.extend((target.include, target.exclude) for target in c.load_manifest(manifest))
+    return c.source_cache_keys(Path(__file__).resolve().parent.parent, entry_lists, resolver, args.structures)
+
+
+def selected_targets(args: argparse.Namespace) -> list[c.BuildTarget]:
+    targets = c.load_manifest(args.manifest)
+    unknown = set(args.target) - {target.name for target in targets}
+    if unknown:
+        raise ValueError(f"{args.manifest} has no target named {', '.join(sorted(unknown))}")
+    return [target for target in targets if not args.target or target.name in args.target]
+
+
+def publish(args: argparse.Namespace, results: list[tuple[str | None, c.BundleResult, float]], cache: c.ContentCache | None, resolver: c.SourceResolver, quiet: bool = False) -> None:
+    import json
+    reports = [c.bundle_report(result, wall_seconds, cache if name is None else None, name) for name, result, wall_seconds in results]
+    if not args.no_history:
+        c.append_history(reports)
+    if args.format == "json":
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, indent=2))
+        return
+    if args.format == "ndjson":
+        for report in reports:
+            print("\n".join(c.report_ndjson_lines(report)))
+        return
+    for name, (path, total_chars, comment_chars, total_bytes, per_file_stats, destinations, pipeline), _ in results:
+        prefix = f"[{name}] " if name else ""
+        if quiet:
+            print(f"{prefix}{'Wrote' if destinations[0].status == 'written' else 'Unchanged'} {path.name}: {total_chars:,} chars, {len(per_file_stats)} sections" + (f" ({cache.misses} reloaded)" if cache is not None and not name else ""))
+        else:
+            if name:
+                print(f"\n=== Target {name} ===")
+            c._print_report(path, total_chars, comment_chars, total_bytes, per_file_stats, None if name else cache, resolver, destinations, pipeline)
+
+
+def build_manifest(args: argparse.Namespace, cache: c.ContentCache | None, resolver: c.SourceResolver, quiet: bool = False) -> list[c.BundleResult]:
+    repo_root = Path(__file__).resolve().parent.parent
+    started = time.perf_counter()
+    results, loader = c.build_targets(
+        selected_targets(args),
+        repo_root,
+        cache,
+        jobs=args.jobs,
+        use_processes=args.processes,
+        resolver=resolver,
+        estimate=args.estimate,
+        max_tokens=args.max_tokens,
+        structures=args.structures,
+        symbols=args.symbols,
+        dedupe=not args.no_dedupe,
+        archive=args.archive,
+        since=args.since,
+        since_diffs=args.diff,
+        fsync=args.fsync,
+        memory_cap=args.memory_cap * 1024 * 1024,
+        tables=c.TableStore() if args.collapse_tables else None,
+    )
+    wall_seconds = time.perf_counter() - started
+    publish(args, [(target.name, result, wall_seconds) for target, result in results], cache, resolver, quiet)
+    if args.format == "text":
+        print(f"Built {c._plural(len(results), 'target')}: {loader.loads:,} entries loaded for {loader.requests:,} sections" + (f" ({cache.misses} reloaded)" if cache is not None else ""))
+    if cache is not None:
+        cache.prune(lambda: listed_sources(args, resolver))
+        cache.save()
+    resolver.save()
+    args.structures.save()
+    args.symbols.save()
+    return [result for _, result in results]
+
+
+def build(args: argparse.Namespace, cache: c.ContentCache | None, resolver: c.SourceResolver, quiet: bool = False) -> list[c.BundleResult]:
+    if args.manifest:
+        return build_manifest(args, cache, resolver, quiet)
+    runs = [(SOURCE_FILES, OUTPUT_FILENAME, SECONDARY_OUTPUT_PATH)]
+    if globals().get("SOURCE_FILES_TEMP"):
+        runs.append((SOURCE_FILES_TEMP, OUTPUT_FILENAME_temp, SECONDARY_OUTPUT_PATH_temp))
+    repo_root = Path(__file__).resolve().parent.parent
+    results = []
+    for source_files, output_filename, secondary_output_path in runs:
+        started = time.perf_counter()
+        source_files = c.expand_entries(repo_root, source_files, SOURCE_EXCLUDES, args.structures)
+        result = c.concatenate_sources_for(
+            source_files,
+            output_filename,
+            secondary_output_path,
+            cache,
+            jobs=args.jobs,
+            use_processes=args.processes,
+            resolver=resolver,
+            max_tokens=args.max_tokens,
+            estimate=args.estimate,
+            priorities=SOURCE_PRIORITIES,
+            structures=args.structures,
+            symbols=args.symbols,
+            dedupe=not args.no_dedupe,
+            archive_path=c.archive_path_for(Path(__file__).resolve().parent / output_filename) if args.archive else None,
+            since=args.since,
+            since_diffs=args.diff,
+            fsync=args.fsync,
+            memory_cap=args.memory_cap * 1024 * 1024,
+            tables=c.TableStore() if args.collapse_tables else None,
+        )
+        publish(args, [(None, result, time.perf_counter() - started)], cache, resolver, quiet)
+        results.append(result)
+    if cache is not None:
+        cache.prune(lambda: listed_sources(args, resolver))
+        cache.save()
+    resolver.save()
+    args.structures.save()
+    args.symbols.save()
+    return results
+
+
+def watch(args: argparse.Namespace, cache: c.ContentCache | None, resolver: c.SourceResolver) -> None:
+    import concat_sources_watch
+    script_path = Path(__file__).resolve()
+    entries = list(SOURCE_FILES) + list(globals().get("SOURCE_FILES_TEMP") or [])
+    restart_paths = {script_path}
+    if args.manifest:
+        entries = [entry for target in selected_targets(args) for entry in target.include]
+        restart_paths.add(args.manifest.resolve())
+    # A glob is watched through its literal base directory so new matches trigger a rebuild.
+    paths = {resolver.resolve(c.glob_base(c.entry_lookup_path(entry))) for entry in entries} | restart_paths
+
+    def rebuild(changed: set[Path]) -> None:
+        if changed & restart_paths:
+            print("Manifest changed; restarting.")
+            os.execv(sys.executable, [sys.executable, str(script_path), *sys.argv[1:]])
+        started = time.perf_counter()
+        resolver.refresh()
+        try:
+            build(args, cache, resolver, quiet=True)
+        except (OSError, ValueError) as error:
+            print(f"Rebuild failed: {error}")
+            return
+        names = ", ".join(sorted(path.name for path in changed))
+        print(f"Rebuilt in {(time.perf_counter() - started) * 1000:.0f} ms after changes to {names}")
+
+    concat_sources_watch.watch(sorted(paths), rebuild, polling=args.poll)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    import argparse
+    parser = argparse.ArgumentParser(prog="concat_sources.py build", description="Concatenate SOURCE_FILES into a single text bundle.", epilog="Other commands: verify, report, compare, extract, expand, bench, serve (see `concat_sources.py <command> -h`).")
+    parser.add_argument("--jobs", "-j", type=int, default=1, help="read and filter files on N worker threads each")
+    parser.add_argument("--memory-cap", type=int, default=c.PIPELINE_MEMORY_CAP // (1024 * 1024), metavar="MB", help="most source text held in the pipeline at once (default: %(default)s)")
+    parser.add_argument("--processes", action="store_true", help="run comment filtering on a process pool (with --jobs > 1)")
+    parser.add_argument("--no-cache", action="store_true", help="ignore and do not update the content cache")
+    parser.add_argument("--force", action="store_true", help="build even if no input changed since the last identical build")
+    parser.add_argument("--server", action="store_true", help="ask a running `serve` process to build, or build here if none is running")
+    parser.add_argument("--watch", action="store_true", help="rebuild whenever a manifest file or directory changes")
+    parser.add_argument("--poll", action="store_true", help="with --watch, poll instead of using inotify")
+    parser.add_argument("--max-tokens", type=int, help="truncate or drop the lowest-priority sections to fit N tokens")
+    parser.add_argument("--tokenizer", default="chars", choices=sorted(c.TOKEN_ESTIMATORS), help="token estimate used for the budget and report")
+    parser.add_argument("--no-dedupe", action="store_true", help="write identical sections in full instead of referring back to the first copy")
+    parser.add_argument("--collapse-tables", action="store_true", help=f"summarize array and dictionary literals of {c.TABLE_MIN_ITEMS}+ items; `expand` restores them")
+    parser.add_argument("--archive", action="store_true", help=f"also write each bundle as an indexed {c.ARCHIVE_SUFFIX} archive of gzip sections")
+    parser.add_argument("--since", metavar="REV", help="only include entries changed since this git revision (working tree included), written to <bundle>.since.txt")
+    parser.add_argument("--diff", action="store_true", help="with --since, write unified diffs instead of whole changed files")
+    parser.add_argument("--fsync", action="store_true", help="flush outputs to disk before renaming them into place")
+    parser.add_argument("--format", default="text", choices=("text", "json", "ndjson"), help="print the report as a table, one JSON document, or JSON lines")
+    parser.add_argument("--no-history", action="store_true", help=f"do not append this run's report to {c.HISTORY_PATH.name}")
+    parser.add_argument("--manifest", type=Path, help="build the targets declared in a .toml/.json manifest instead of SOURCE_FILES")
+    parser.add_argument("--target", action="append", default=[], help="with --manifest, build only this target (repeatable)")
+    return parser
+
+
+def loaded_state(*paths: Path) -> dict[Path, int | None]:
+    """The mtime of each path (None if missing), to tell whether it changed since it was loaded."""
+    state: dict[Path, int | None] = {}
+    for path in paths:
+        try:
+            state[path] = path.stat().st_mtime_ns
+        except OSError:
+            state[path] = None
+    return state
+
+
+def open_caches(args: argparse.Namespace, warm: dict | None = None) -> tuple[c.ContentCache | None, c.SourceResolver]:
+    """Load the caches for a build, or reuse the ones kept in warm by a previous build."""
+    repo_root = Path(__file__).resolve().parent.parent
+    if args.no_cache:
+        args.structures, args.symbols = c.StructureCache(None), c.SymbolIndex(None)
+        return None, c.SourceResolver(repo_root)
+    if warm and "resolver" in warm:
+        warm["resolver"].refresh()
+    else:
+        warm = {} if warm is None else warm
+        warm.update(
+            cache=c.ContentCache(),
+            resolver=c.SourceResolver(repo_root, c.RESOLVE_INDEX_PATH),
+            structures=c.StructureCache(c.STRUCTURE_CACHE_PATH),
+            symbols=c.SymbolIndex(c.SYMBOL_INDEX_PATH),
+        )
+    args.structures, args.symbols = warm["structures"], warm["symbols"]
+    return warm["cache"], warm["resolver"]
+
+
+def run_build(argv: list[str], key: str | None = None, warm: dict | None = None) -> int:
+    import concat_sources_fingerprint
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.diff and not args.since:
+        parser.error("--diff needs --since")
+    if args.watch and warm is not None:
+        parser.error("--watch cannot run on the build server")
+    try:
+        args.estimate = c.get_token_estimator(args.tokenizer)
+    except ValueError as error:
+        parser.error(str(error))
+    cache, resolver = open_caches(args, warm)
+
+    started = time.time()
+    try:
+        results = build(args, cache, resolver)
+    except ValueError as error:
+        sys.exit(f"error: {error}")
+    # Only a build that reached every destination, run by the script and library
+    # as they are now on disk, may be skipped next time.
+    loaded = warm.get("loaded") if warm else None
+    if loaded and loaded_state(*loaded) != loaded:
+        print("warning: the script or library changed while the server had it loaded; not recording this build as current.", file=sys.stderr)
+    elif key is not None and all(destination.status != "failed" for result in results for destination in result.destinations):
+        inputs, outputs = c.bundle_inputs(results, resolver, args.structures)
+        inputs.update(str(path) for path in (Path(__file__).resolve(), Path(c.__file__).resolve(), args.manifest and args.manifest.resolve()) if path)
+        concat_sources_fingerprint.record(key, inputs, outputs, started)
+    if args.format == "text":
+        print(f"Completed at {time.strftime('%Y-%m-%d %H:%M:%S')}")
+    if args.watch:
+        watch(args, cache, resolver)
+    return 0
+
+
+def build_command(argv: list[str], warm: dict | None = None) -> int:
+    """Build, unless nothing changed since the same command last built (see --force).
+
+    The up-to-date check and the hand-off to a build server happen before the
+    library is imported, which is what keeps a no-op run down to milliseconds.
+    """
+    import concat_sources_fingerprint
+    if "--server" in argv and warm is None:
+        import concat_sources_server
+        code = concat_sources_server.request(["build", *(arg for arg in argv if arg != "--server")])
+        if code is not None:
+            return code
+        print("No build server is running; building here.", file=sys.stderr)
+    key = concat_sources_fingerprint.build_key(argv)
+    if key is not None:
+        previous = concat_sources_fingerprint.is_current(key)
+        if previous is not None:
+            print(f"Up to date: no inputs changed since the build at {previous['built']} (--force to rebuild).")
+            return 0
+    return run_build(argv, key, warm)
+
+
+def report(argv: list[str]) -> int:
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog="concat_sources.py report", description="Show a build recorded in the history file.")
+    parser.add_argument("run", nargs="?", type=int, default=-1, help="history position for the output (default: -1, the latest)")
+    parser.add_argument("--output", help="bundle file name (default: the most recently built)")
+    parser.add_argument("--history", type=Path, default=c.HISTORY_PATH)
+    parser.add_argument("--format", default="text", choices=("text", "json"))
+    parser.add_argument("--top", type=int, default=10, help="how many of the largest sections to list")
+    args = parser.parse_args(argv)
+    history = c.read_history(args.history)
+    output = args.output or (Path(history[-1]["output"]).name if history else None)
+    runs = [item for item in history if Path(item["output"]).name == output]
+    try:
+        recorded = runs[args.run]
+    except IndexError:
+        print(f"No build {args.run} of {output or 'any bundle'} in {args.history} ({len(runs)} recorded)", file=sys.stderr)
+        return 1
+    print(json.dumps(recorded, indent=2) if args.format == "json" else "\n".join(c.summarize_report(recorded, args.top)))
+    return 0
+
+
+def extract(argv: list[str]) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog="concat_sources.py extract", description="Print sections from a bundle archive.")
+    parser.add_argument("archive", type=Path)
+    parser.add_argument("paths", nargs="*", help="manifest entries to print; lists the archive when omitted")
+    args = parser.parse_args(argv)
+    with c.BundleArchive(args.archive) as archive:
+        if not args.paths:
+            for entry in archive.sections:
+                print(f"{entry['chars']:>9,} chars  {entry['length']:>8,} bytes  {entry['sha256'][:12]}  {entry['path']}")
+            return 0
+        for rel_path in args.paths:
+            try:
+                sys.stdout.write(archive.section(rel_path))
+            except KeyError as error:
+                print(error.args[0], file=sys.stderr)
+                return 1
+    return 0
+
+
+def verify(argv: list[str]) -> int:
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(prog="concat_sources.py verify", description="Check whether built bundles and their copies still match the tree, without rebuilding.")
+    parser.add_argument("--jobs", "-j", type=int, help="hash and re-check on N threads (default: Python's thread pool default)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use or update the caches when re-reading changed sources")
+    parser.add_argument("--format", default="text", choices=("text", "json"))
+    parser.add_argument("--manifest", type=Path, help="verify the targets of a .toml/.json manifest instead of SOURCE_FILES")
+    parser.add_argument("--target", action="append", default=[], help="with --manifest, verify only this target (repeatable)")
+    args = parser.parse_args(argv)
+    cache, resolver = open_caches(args)
+    repo_root = Path(__file__).resolve().parent.parent
+    try:
+        if args.manifest:
+            bundles = [(target.output.resolve(), c.expand_entries(repo_root, target.include, target.exclude, args.structures)) for target in selected_targets(args)]
+        else:
+            runs = [(SOURCE_FILES, OUTPUT_FILENAME)] + ([(SOURCE_FILES_TEMP, OUTPUT_FILENAME_temp)] if globals().get("SOURCE_FILES_TEMP") else [])
+            bundles = [(Path(__file__).resolve().parent / output_filename, c.expand_entries(repo_root, source_files, SOURCE_EXCLUDES, args.structures)) for source_files, output_filename in runs]
+        results = [c.verify_bundle(output_path, repo_root, entries, resolver, cache, args.structures, args.symbols, args.jobs) for output_path, entries in bundles]
+    except ValueError as error:
+        print(f"error: {error}", file=sys.stderr)
+        return 2
+    if cache is not None:
+        cache.save()
+    resolver.save()
+    args.structures.save()
+    args.symbols.save()
+    if args.format == "json":
+        print(json.dumps([{**result._asdict(), "output": str(result.output), "fresh": result.fresh, "copies": [{**copy._asdict(), "path": str(copy.path)} for copy in result.copies]} for result in results], indent=2))
+    else:
+        for result in results:
+            print("\n".join(c.verify_lines(result)))
+    return 0 if all(result.fresh for result in results) else 1
+
+
+def expand(argv: list[str]) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog="concat_sources.py expand", description="Restore tables collapsed by --collapse-tables.")
+    parser.add_argument("bundle", type=Path, help="bundle (or any text) holding collapsed tables")
+    parser.add_argument("--table", action="append", default=[], metavar="HASH", help="print only this table (repeatable)")
+    args = parser.parse_args(argv)
+    store = c.TableStore()
+    if args.table:
+        for digest in args.table:
+            literal = store.get(digest)
+            if literal is None:
+                print(f"No table {digest} in {store.directory}", file=sys.stderr)
+                return 1
+            print(literal)
+        return 0
+    text, missing = c.expand_tables(args.bundle.read_text(encoding="utf-8"), store)
+    sys.stdout.write(text)
+    if missing:
+        print(f"Could not restore {c._plural(len(missing), 'table')}: {', '.join(missing)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def compare(argv: list[str]) -> int:
+    import argparse
+    parser = argparse.ArgumentParser(prog="concat_sources.py compare", description="Compare two builds recorded in the history file.")
+    parser.add_argument("runs", nargs="*", type=int, default=[-2, -1], help="history positions to compare for the output (default: -2 -1)")
+    parser.add_argument("--output", help="bundle file name to compare (default: the most recently built)")
+    parser.add_argument("--history", type=Path, default=c.HISTORY_PATH)
+    args = parser.parse_args(argv)
+    if len(args.runs) != 2:
+        parser.error("give exactly two history positions")
+    history = c.read_history(args.history)
+    output = args.output or (Path(history[-1]["output"]).name if history else None)
+    runs = [report for report in history if Path(report["output"]).name == output]
+    try:
+        before, after = runs[args.runs[0]], runs[args.runs[1]]
+    except IndexError:
+        print(f"Not enough builds of {output or 'any bundle'} in {args.history} ({len(runs)} recorded)", file=sys.stderr)
+        return 1
+    print("\n".join(c.compare_reports(before, after)))
+    return 0
+
+
+def bench(argv: list[str]) -> int:
+    import concat_sources_bench
+    return concat_sources_bench.main(argv)
+
+
+def serve(argv: list[str]) -> int:
+    import argparse
+    import concat_sources_server
+    parser = argparse.ArgumentParser(prog="concat_sources.py serve", description="Keep the caches loaded and build whenever `build --server` asks.")
+    parser.add_argument("--stop", action="store_true", help="stop the running server")
+    args = parser.parse_args(argv)
+    if args.stop:
+        return 0 if concat_sources_server.stop() else 1
+    # Builds run the SOURCE_FILES and library loaded here, so an edit to either
+    # (or the manifest, as --watch treats it) restarts the server.
+    script_path = Path(__file__).resolve()
+    warm: dict = {"loaded": loaded_state(script_path, Path(c.__file__).resolve(), DEFAULT_MANIFEST)}
+
+    def handle(request: list[str]) -> int:
+        command, rest = split_command(request)
+        if command in ("serve", "bench"):
+            print(f"error: {command} cannot run on the build server", file=sys.stderr)
+            return 2
+        return build_command(rest, warm) if command == "build" else COMMANDS[command](rest)
+
+    def stale() -> bool:
+        return loaded_state(*warm["loaded"]) != warm["loaded"]
+
+    code = concat_sources_server.serve(handle, stale=stale)
+    if code is None:
+        print("Script, library or manifest changed; restarting.", flush=True)
+        os.execv(sys.executable, [sys.executable, str(script_path), *sys.argv[1:]])
+    return code
+
+
+COMMANDS = {"build": build_command, "report": report, "compare": compare, "extract": extract, "expand": expand, "verify": verify, "bench": bench, "serve": serve}
+
+
+def split_command(argv: list[str]) -> tuple[str, list[str]]:
+    """Split off the subcommand; bare options (or nothing) mean build, as they always have."""
+    if argv[:1] and argv[0] in COMMANDS:
+        return argv[0], argv[1:]
+    return "build", argv
+
+
+def main(argv: list[str] | None = None) -> None:
+    command, argv = split_command(sys.argv[1:] if argv is None else argv)
+    sys.exit(COMMANDS[command](argv))
+
+
 if __name__ == "__main__":
-    path, total_chars, comment_chars, total_bytes, per_file_stats = c.concatenate_sources(SOURCE_FILES, OUTPUT_FILENAME, SECONDARY_OUTPUT_PATH); c._print_report(path, total_chars, comment_chars, total_bytes, per_file_stats); source_files_temp = globals().get("SOURCE_FILES_TEMP")
-    if source_files_temp:
-        t_path, t_chars, t_comments, t_bytes, t_stats = c.concatenate_sources_for(source_files_temp, OUTPUT_FILENAME_temp, SECONDARY_OUTPUT_PATH_temp);c._print_report(t_path, t_chars, t_comments, t_bytes, t_stats)
-    print(f"Completed at {c.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    main()
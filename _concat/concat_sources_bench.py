@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Benchmarks for the concat_sources pipeline.
+
+`pipeline` builds a synthetic tree of Swift files and binary assets, times each
+stage of the pipeline on it and saves the results as JSON; `filter` compares the
+comment filters on an existing bundle.
+"""
+from __future__ import annotations
+
+import argparse
+import cProfile
+import json
+import random
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import concat_sources_lib as c
+
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent / "concatenated_MVR.txt"
+BENCH_RESULTS_DIR = c.CACHE_DIR / "bench"
+BINARY_EXTENSIONS = (".usdz", ".ktx", ".exr")
+LIBRARY_NAMES = ("AnimLibS", "CoreLibS", "AILibS", "AssetLibS", "MatheMagicApp")
+
+
+def bench_comment_filter(corpus: Path = DEFAULT_CORPUS, repeat: int = 5, number: int = 10) -> dict:
+    """Time filter_comment_lines against the line-based filter it replaced."""
+    text = corpus.read_text(encoding="utf-8")
+    size_bytes = len(text.encode("utf-8"))
+    results: dict = {"corpus": str(corpus), "bytes": size_bytes}
+    for name, func in (
+        ("by_line", c.filter_comment_lines_by_line),
+        ("tokenizer", c.filter_comment_lines),
+    ):
+        best = min(timeit.repeat(lambda: func(text), number=number, repeat=repeat)) / number
+        results[name] = {"seconds": best, "mb_per_s": size_bytes / best / 1e6}
+    results["speedup"] = results["by_line"]["seconds"] / results["tokenizer"]["seconds"]
+    return results
+
+
+def _print_filter_results(results: dict) -> None:
+    print(f"Corpus: {results['corpus']} ({results['bytes'] / 1024:,.1f} KB)")
+    for name in ("by_line", "tokenizer"):
+        timing = results[name]
+        print(f"  {name:<10} {timing['seconds'] * 1000:8.2f} ms  {timing['mb_per_s']:8.2f} MB/s")
+    print(f"  speedup    {results['speedup']:8.2f}x")
+
+
+def _synthetic_swift(rng: random.Random, name: str, lines: int) -> str:
+    out = [
+        f"// {name}.swift",
+        "// Generated for the concat_sources benchmark.",
+        "import Foundation",
+        "import RealityKit",
+        "",
+        f"/// Documentation for {name}.",
+        f"struct {name} {{",
+    ]
+    while len(out) < lines:
+        index = len(out)
+        roll = rng.random()
+        if roll < 0.15:
+            out.append(f"    // step {index}: adjust the pose before blending")
+        elif roll < 0.2:
+            out.append(f"    // warning: value {index} is clamped to avoid an error")
+        elif roll < 0.25:
+            out.append(f"    /* block {index}\n       spans two lines */")
+        elif roll < 0.35:
+            out.append(f'    let label{index} = "path://{name}/{index}" // trailing note')
+        elif roll < 0.4:
+            out.append(f'    let url{index} = "\\(host ?? "http://{name}")/{index}" // interpolated host')
+        else:
+            values = ", ".join(f"{rng.uniform(-1, 1):.4f}" for _ in range(4))
+            out.append(f"    var value{index}: SIMD4<Float> = [{values}]")
+    out.append("}")
+    return "\n".join(out) + "\n"
+
+
+def make_synthetic_tree(
+    repo_root: Path,
+    swift_files: int,
+    binary_files: int = 0,
+    swift_lines: int = 120,
+    binary_kb: int = 256,
+    seed: int = 0,
+) -> list[str]:
+    """Write a repo-shaped tree of Swift files and binary assets; return its manifest."""
+    rng = random.Random(seed)
+    manifest: list[str] = []
+    for index in range(swift_files):
+        library = LIBRARY_NAMES[index % len(LIBRARY_NAMES)]
+        rel_path = f"{library}/Group{index // 50:03d}/File{index:05d}.swift"
+        path = repo_root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(_synthetic_swift(rng, f"File{index:05d}", swift_lines), encoding="utf-8")
+        manifest.append(rel_path)
+    for index in range(binary_files):
+        extension = BINARY_EXTENSIONS[index % len(BINARY_EXTENSIONS)]
+        rel_path = f"Resources/Asset{index:04d}{extension}"
+        path = repo_root / rel_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # A leading 0xff byte guarantees the UTF-8 decode fails, as for real assets.
+        path.write_bytes(b"\xff" + rng.randbytes(binary_kb * 1024 - 1))
+        manifest.append(rel_path)
+    return manifest
+
+
+def _peak_rss_bytes() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_pipeline(repo_root: Path, manifest: list[str], work_dir: Path, jobs: int = 1) -> dict:
+    """Time each pipeline stage over manifest, then the end-to-end build cold and warm."""
+    source_bytes = sum((repo_root / rel_path).stat().st_size for rel_path in manifest)
+    stages: dict[str, dict] = {}
+
+    def record(name: str, seconds: float) -> None:
+        stages[name] = {
+            "seconds": seconds,
+            "mb_per_s": source_bytes / seconds / 1e6 if seconds else None,
+        }
+
+    started = time.perf_counter()
+    paths = [c.resolve_source_path(repo_root, rel_path) for rel_path in manifest]
+    record("resolve_source_path", time.perf_counter() - started)
+
+    resolver = c.SourceResolver(repo_root)
+    started = time.perf_counter()
+    for rel_path in manifest:
+        resolver.resolve(rel_path)
+    record("source_resolver", time.perf_counter() - started)
+
+    sections: list[str] = []
+    load_seconds = filter_seconds = 0.0
+    for path in paths:
+        stats = c.LoadStats()
+        sections.append(c.load_source_content(path, stats))
+        load_seconds += stats.load_seconds
+        filter_seconds += stats.filter_seconds
+    record("load_source_content", load_seconds)
+    record("filter_comment_lines", filter_seconds)
+
+    started = time.perf_counter()
+    for section in sections:
+        c.sum_comment_characters(section)
+    record("sum_comment_characters", time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with c.BundleWriter(work_dir / "bench_write.txt") as writer:
+        for section in sections:
+            writer.write(section)
+    record("write", time.perf_counter() - started)
+    del sections
+
+    cache = c.ContentCache(work_dir / "bench_cache.json")
+    for name in ("end_to_end_cold", "end_to_end_warm"):
+        started = time.perf_counter()
+        c.concatenate_sources_for(
+            manifest, str(work_dir / f"{name}.txt"), None, cache, jobs=jobs,
+            resolver=c.SourceResolver(repo_root), repo_root=repo_root,
+        )
+        record(name, time.perf_counter() - started)
+
+    return {
+        "files": len(manifest),
+        "source_bytes": source_bytes,
+        "jobs": jobs,
+        "stages": stages,
+        "peak_rss_bytes": _peak_rss_bytes(),
+    }
+
+
+def _print_pipeline_results(results: dict, previous: dict | None = None) -> None:
+    print(
+        f"{results['files']:,} files, {results['source_bytes'] / 1024 / 1024:,.2f} MB,"
+        f" jobs={results['jobs']}"
+    )
+    for name, timing in results["stages"].items():
+        line = f"  {name:<24} {timing['seconds'] * 1000:10.2f} ms"
+        if timing["mb_per_s"] is not None:
+            line += f"  {timing['mb_per_s']:9.2f} MB/s"
+        before = (previous or {}).get("stages", {}).get(name)
+        if before and before["seconds"]:
+            change = (timing["seconds"] - before["seconds"]) / before["seconds"] * 100
+            line += f"  ({change:+.1f}% vs previous)"
+        print(line)
+    if results["peak_rss_bytes"] is not None:
+        print(f"  peak RSS {results['peak_rss_bytes'] / 1024 / 1024:,.1f} MB")
+
+
+def _run_pipeline(args: argparse.Namespace) -> dict:
+    with tempfile.TemporaryDirectory(prefix="concat_bench_") as scratch:
+        scratch_dir = Path(scratch)
+        repo_root = args.tree or scratch_dir / "repo"
+        manifest = make_synthetic_tree(
+            repo_root, args.files, args.binaries, args.lines, args.binary_kb, args.seed
+        )
+        return bench_pipeline(repo_root, manifest, scratch_dir, args.jobs)
+
+
+def _pipeline_main(args: argparse.Namespace) -> int:
+    output = args.output or BENCH_RESULTS_DIR / f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    if args.profile:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        results = profiler.runcall(_run_pipeline, args)
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        profiler.dump_stats(output.with_suffix(".prof"))
+        top = snapshot.statistics("lineno")[:25]
+        output.with_suffix(".tracemalloc.txt").write_text(
+            "\n".join(str(stat) for stat in top) + "\n", encoding="utf-8"
+        )
+    else:
+        results = _run_pipeline(args)
+
+    results["timestamp"] = datetime.now().isoformat(timespec="seconds")
+    output.write_text(json.dumps(results, indent=2), encoding="utf-8")
+
+    previous = json.loads(args.compare.read_text(encoding="utf-8")) if args.compare else None
+    _print_pipeline_results(results, previous)
+    print(f"Saved results to {output}")
+    if args.profile:
+        print(f"Saved profile to {output.with_suffix('.prof')} and {output.with_suffix('.tracemalloc.txt')}")
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the concat_sources pipeline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pipeline_parser = subparsers.add_parser("pipeline", help="time each stage on a synthetic tree")
+    pipeline_parser.add_argument("--files", type=int, default=500, help="number of Swift files")
+    pipeline_parser.add_argument("--binaries", type=int, default=12, help="number of binary assets")
+    pipeline_parser.add_argument("--lines", type=int, default=120, help="lines per Swift file")
+    pipeline_parser.add_argument("--binary-kb", type=int, default=256, help="size of each binary asset")
+    pipeline_parser.add_argument("--seed", type=int, default=0)
+    pipeline_parser.add_argument("--jobs", "-j", type=int, default=1)
+    pipeline_parser.add_argument("--tree", type=Path, help="build the synthetic tree here and keep it")
+    pipeline_parser.add_argument("--output", type=Path, help="where to save the JSON results")
+    pipeline_parser.add_argument("--compare", type=Path, help="earlier results JSON to compare against")
+    pipeline_parser.add_argument(
+        "--profile", action="store_true", help="also dump cProfile stats and the top tracemalloc sites"
+    )
+
+    filter_parser = subparsers.add_parser("filter", help="compare the comment filters on a corpus")
+    filter_parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    filter_parser.add_argument("--repeat", type=int, default=5)
+    filter_parser.add_argument("--json", action="store_true", help="print results as JSON")
+    filter_parser.add_argument(
+        "--check", action="store_true", help="exit non-zero if the tokenizer is slower than the line filter"
+    )
+
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] not in subparsers.choices and argv[0] not in ("-h", "--help"):
+        argv = ["pipeline", *argv]
+    args = parser.parse_args(argv)
+
+    if args.command == "pipeline":
+        return _pipeline_main(args)
+
+    results = bench_comment_filter(args.corpus, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        _print_filter_results(results)
+    if args.check and results["speedup"] < 1.0:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
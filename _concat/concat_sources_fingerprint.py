@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Stat fingerprints of past builds, so an unchanged rebuild can exit straight away.
+
+After a successful build the script records the mtime and size of every file
+and directory the build read or wrote, keyed by its command line. The next run
+with the same command line stats those paths again and, if nothing moved,
+skips the build. This module only uses os and json so the check runs before
+the heavy imports.
+"""
+from __future__ import annotations
+
+import json
+import os
+import time
+from collections.abc import Iterable
+
+
+FINGERPRINT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "fingerprints.json")
+FINGERPRINT_VERSION = 1
+FINGERPRINT_MAX_BUILDS = 16
+
+# Options whose runs depend on more than the files on disk.
+_UNCACHEABLE = {"--watch", "--since", "--force", "--no-cache", "--help", "-h"}
+
+
+def build_key(argv: Iterable[str]) -> str | None:
+    """The key for a build command line, or None if its result cannot be reused.
+
+    Runs asking for a JSON report are never skipped, since they expect one.
+    """
+    argv = [arg for arg in argv if arg != "--server"]
+    for index, arg in enumerate(argv):
+        option, _, value = arg.partition("=")
+        if option in _UNCACHEABLE:
+            return None
+        if option == "--format" and (value or next(iter(argv[index + 1 :]), "")) != "text":
+            return None
+    return json.dumps([os.getcwd(), *argv])
+
+
+def _stat(path: str) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _read(path: str) -> dict:
+    try:
+        with open(path, encoding="utf-8") as handle:
+            data = json.load(handle)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != FINGERPRINT_VERSION:
+        return {}
+    return data.get("builds", {})
+
+
+def is_current(key: str, path: str = FINGERPRINT_PATH) -> dict | None:
+    """Return the recorded build for key if none of its paths changed since, else None."""
+    build = _read(path).get(key)
+    if build is None:
+        return None
+    for input_path, recorded in build["paths"].items():
+        if _stat(input_path) != recorded:
+            return None
+    return build
+
+
+def record(key: str, inputs: Iterable[str], outputs: Iterable[str], started: float, path: str = FINGERPRINT_PATH) -> None:
+    """Remember the current state of a finished build's inputs and outputs.
+
+    An input modified after the build started (time.time() at `started`) may
+    have been read before the change, so it is recorded as changed.
+    """
+    started_ns = int(started * 1e9)
+    paths: dict[str, list[int] | None] = {}
+    for input_path in inputs:
+        stat = _stat(input_path)
+        paths[input_path] = [-1, -1] if stat is not None and stat[0] >= started_ns else stat
+    for output_path in outputs:
+        paths[output_path] = _stat(output_path)
+
+    builds = _read(path)
+    builds.pop(key, None)
+    builds[key] = {"built": time.strftime("%Y-%m-%d %H:%M:%S"), "paths": paths}
+    for stale in list(builds)[:-FINGERPRINT_MAX_BUILDS]:
+        del builds[stale]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as handle:
+        json.dump({"version": FINGERPRINT_VERSION, "builds": builds}, handle)
+    os.replace(tmp_path, path)
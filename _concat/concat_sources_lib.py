@@ -1,19 +1,75 @@
 #!/usr/bin/env python3
 from __future__ import annotations
 
+import codecs
 import hashlib
+import json
+import os
 import re
-from datetime import datetime
+import struct
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass, field
+from fnmatch import fnmatch, fnmatchcase
 from pathlib import Path
+from stat import S_ISDIR
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    import queue
+    from concurrent.futures import Executor, Future
+
+# asyncio, concurrent.futures, mmap, subprocess, zlib and friends are imported
+# where they are used, so loading this module stays cheap for quick commands.
 
 
 ERROR_WARNING_PATTERN = re.compile(r"\b(warn(?:ing|ings)?|error(?:s)?)\b", re.IGNORECASE)
 
+CACHE_DIR = Path(__file__).resolve().parent / ".cache"
+CONTENT_CACHE_PATH = CACHE_DIR / "content_cache.json"
+RESOLVE_INDEX_PATH = CACHE_DIR / "resolve_index.json"
+STRUCTURE_CACHE_PATH = CACHE_DIR / "structure_cache.json"
+HISTORY_PATH = CACHE_DIR / "history.ndjson"
+HISTORY_MAX_RUNS = 50  # per output
+HISTORY_MAX_BYTES = 8 * 1024 * 1024
+SYMBOL_INDEX_PATH = CACHE_DIR / "symbol_index.json"
+SYMBOL_INDEX_MAX_FILES = 4096
+# Bump whenever scan_swift_declarations (or the masking under it) changes its spans.
+SYMBOL_INDEX_VERSION = 1
+# Bump whenever filter_comment_lines / describe_binary_file change their output,
+# so stale filtered content is never served from an older cache file.
+CONTENT_CACHE_VERSION = 8
+CONTENT_CACHE_MAX_ENTRIES = 4096
+CONTENT_CACHE_MAX_CHARS = 64 * 1024 * 1024
+# How stale an entry's last_used may get before a hit writes the index to refresh it.
+CONTENT_CACHE_LAST_USED_RESOLUTION = 24 * 60 * 60
+HASH_CHUNK_SIZE = 1024 * 1024
+BINARY_SNIFF_SIZE = 8 * 1024
+DIRECTORY_LISTING_MAX_ENTRIES = 500
+DIRECTORY_LISTING_EXCLUDES = (".DS_Store",)
+BUDGET_MIN_TRUNCATED_TOKENS = 64
+ARCHIVE_SUFFIX = ".cgz"
+ARCHIVE_COMPRESSION_LEVEL = 6
+INTEGRITY_SUFFIX = ".integrity.json"
+INTEGRITY_VERSION = 1
+SINCE_INFIX = ".since"
+STRUCTURE_PREFIX = "structure:"
+SYMBOL_SEPARATOR = "::"
+LISTING_SEPARATOR = "#"
+STRUCTURE_EXCLUDES = (".*", "*.xcassets")
+STRUCTURE_CACHE_VERSION = 2
+STRUCTURE_CACHE_MAX_ENTRIES = 65536
+TABLE_STORE_DIR = CACHE_DIR / "tables"
+TABLE_MIN_ITEMS = 32
+TABLE_MIN_BYTES = 1024
+TABLE_PREVIEW_ITEMS = 3
+TABLE_PREVIEW_CHARS = 72
 
-def resolve_source_path(repo_root: Path, rel_path: str) -> Path:
-    """Return the first matching filesystem path for the given relative entry."""
-    rel = Path(rel_path)
 
+def _search_roots(repo_root: Path) -> list[Path]:
     search_roots: list[Path] = []
     seen_roots: set[Path] = set()
 
@@ -35,7 +91,10 @@ def resolve_source_path(repo_root: Path, rel_path: str) -> Path:
         if canonical_root.exists():
             add_root(canonical_root)
             add_root(canonical_root / "MacVRSpatial")
+    return search_roots
 
+
+def _path_variants(rel: Path) -> list[Path]:
     rel_variants: list[Path] = []
     seen_variants: set[Path] = set()
 
@@ -50,10 +109,14 @@ def resolve_source_path(repo_root: Path, rel_path: str) -> Path:
         add_variant(Path("MacVRSpatial") / rel)
         if len(rel.parts) > 1:
             add_variant(Path(*rel.parts[1:]))
+    return rel_variants
+
 
+def resolve_source_path(repo_root: Path, rel_path: str) -> Path:
+    """Return the first matching filesystem path for the given relative entry."""
     attempted: list[Path] = []
-    for root in search_roots:
-        for variant in rel_variants:
+    for root in _search_roots(repo_root):
+        for variant in _path_variants(Path(rel_path)):
             candidate = root / variant
             attempted.append(candidate)
             if candidate.exists():
@@ -65,6 +128,143 @@ def resolve_source_path(repo_root: Path, rel_path: str) -> Path:
     )
 
 
+class SourceResolver:
+    """Index-backed replacement for resolve_source_path.
+
+    Each directory on a candidate path is listed once with os.scandir and kept as a
+    name -> is_dir map, so a lookup walks dictionaries instead of calling exists()
+    on every root/variant combination, and repeated entries are answered from a
+    memo. Listings can be persisted to index_path; a persisted listing is reused
+    for as long as the directory's mtime is unchanged. Entries found under more
+    than one root are recorded in `ambiguous` (the first match still wins, as in
+    resolve_source_path). Anything the index cannot place, such as a differently
+    cased name on a case-insensitive volume, falls back to resolve_source_path.
+    """
+
+    def __init__(self, repo_root: Path, index_path: Path | None = None) -> None:
+        self.repo_root = repo_root
+        self.roots = _search_roots(repo_root)
+        self.index_path = index_path
+        self.ambiguous: dict[str, list[Path]] = {}
+        self._listings: dict[str, tuple[int, dict[str, bool]]] = {}
+        self._validated: set[str] = set()
+        self._resolved: dict[str, tuple[Path, Path]] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if index_path is not None:
+            self._read()
+
+    def _read(self) -> None:
+        try:
+            data = json.loads(self.index_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict):
+            self._listings = {
+                directory: (mtime_ns, listing)
+                for directory, (mtime_ns, listing) in data.get("listings", {}).items()
+            }
+
+    def save(self) -> None:
+        if self.index_path is None or not self._dirty:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            payload = json.dumps({"listings": self._listings})
+        tmp_path = self.index_path.with_name(self.index_path.name + ".tmp")
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def _listing(self, key: str) -> dict[str, bool]:
+        cached = self._listings.get(key)
+        if cached is not None and key in self._validated:
+            return cached[1]
+
+        try:
+            mtime_ns = os.stat(key).st_mtime_ns
+        except OSError:
+            mtime_ns = -1
+        if cached is not None and cached[0] == mtime_ns:
+            self._validated.add(key)
+            return cached[1]
+
+        listing: dict[str, bool] = {}
+        if mtime_ns != -1:
+            try:
+                with os.scandir(key) as entries:
+                    for entry in entries:
+                        try:
+                            listing[entry.name] = entry.is_dir()
+                        except OSError:
+                            listing[entry.name] = False
+            except OSError:
+                pass
+        with self._lock:
+            self._listings[key] = (mtime_ns, listing)
+            self._validated.add(key)
+            self._dirty = True
+        return listing
+
+    def _indexed(self, root: Path, variant: Path) -> bool:
+        directory = str(root)
+        parts = variant.parts
+        last = len(parts) - 1
+        for position, part in enumerate(parts):
+            is_dir = self._listing(directory).get(part)
+            if is_dir is None or (position < last and not is_dir):
+                return False
+            directory = os.path.join(directory, part)
+        return True
+
+    def matches(self, rel_path: str) -> list[tuple[Path, Path]]:
+        """Return every (root, path) pair at which the entry exists, in search order."""
+        rel = Path(rel_path)
+        if rel.is_absolute() or ".." in rel.parts:
+            return []
+        variants = _path_variants(rel)
+        found: list[tuple[Path, Path]] = []
+        for root in self.roots:
+            for variant in variants:
+                if self._indexed(root, variant):
+                    found.append((root, root / variant))
+        return found
+
+    def resolve_with_root(self, rel_path: str) -> tuple[Path, Path]:
+        """Return (search root, resolved path) for a manifest entry."""
+        resolved = self._resolved.get(rel_path)
+        if resolved is not None:
+            return resolved
+
+        found = self.matches(rel_path)
+        if found:
+            if len(found) > 1:
+                distinct = {os.path.realpath(path): path for _, path in found}
+                if len(distinct) > 1:
+                    self.ambiguous[rel_path] = list(distinct.values())
+            resolved = found[0]
+        else:
+            path = resolve_source_path(self.repo_root, rel_path)
+            root = next((root for root in self.roots if path.is_relative_to(root)), self.repo_root)
+            resolved = (root, path)
+        self._resolved[rel_path] = resolved
+        return resolved
+
+    def resolve(self, rel_path: str) -> Path:
+        return self.resolve_with_root(rel_path)[1]
+
+    def refresh(self) -> None:
+        """Forget resolved entries so the next lookups re-check directory mtimes.
+
+        For long-lived resolvers: listings stay cached, but files added or
+        moved since the last build are found again.
+        """
+        with self._lock:
+            self._validated.clear()
+            self._resolved.clear()
+            self.ambiguous.clear()
+
+
 def sum_comment_characters(text: str) -> int:
     total = 0
     for line in text.splitlines():
@@ -74,7 +274,623 @@ def sum_comment_characters(text: str) -> int:
     return total
 
 
-def filter_comment_lines(text: str) -> str:
+# Opening tokens the Swift comment stripper reacts to. Raw strings (#"...", #"""...)
+# are matched before plain quotes so their hashes are consumed with them; the
+# leading lookahead lets the regex engine skip ordinary code quickly.
+_SWIFT_TOKEN_PATTERN = re.compile(
+    r'(?=[/#"])(?:(?P<line>//[^\n]*)|(?P<block>/\*)|(?P<raw>#+"(?:"")?)|(?P<multi>""")|(?P<string>"))'
+)
+# String bodies up to the closing quote. They step over escapes and over
+# interpolations holding no quotes, escapes or deeper nesting, and stop short
+# at any other \( , which _literal_end then rescans.
+_STRING_BODY = re.compile(r'[^"\\\n]*(?:(?:\\[^(\n]|\\\((?:[^()"\\\n]|\([^()"\\\n]*\))*\))[^"\\\n]*)*"?')
+_MULTILINE_BODY = re.compile(
+    r'[^"\\]*(?:(?:\\[^(]|\\\((?:[^()"\\]|\([^()"\\]*\))*\)|"(?!""))[^"\\]*)*(?:"""|\Z)'
+)
+_BLOCK_DELIMITER = re.compile(r"/\*|\*/")
+_TRAILING_BLANKS = re.compile(r"[ \t]*(?:\n|\Z)")
+_LEADING_BLANKS = re.compile(r"[ \t]*")
+_NON_NEWLINE = re.compile(r"[^\n]")
+
+
+def _block_comment_end(text: str, start: int) -> int:
+    depth = 1
+    for match in _BLOCK_DELIMITER.finditer(text, start + 2):
+        depth += 1 if match.group() == "/*" else -1
+        if depth == 0:
+            return match.end()
+    return len(text)
+
+
+def _raw_string_end(text: str, opener: str, start: int) -> int:
+    hashes = opener.count("#")
+    if opener.endswith('"""'):
+        closing = '"""' + "#" * hashes
+        found = text.find(closing, start)
+        return len(text) if found == -1 else found + len(closing)
+    closing = '"' + "#" * hashes
+    found = text.find(closing, start)
+    newline = text.find("\n", start)
+    if found == -1 or (newline != -1 and newline < found):
+        return len(text) if newline == -1 else newline
+    return found + len(closing)
+
+
+# Tokens inside a \( ... ) interpolation: parentheses are counted and nested
+# literals and comments skipped, so a quote or "//" in there ends nothing.
+_INTERPOLATION_TOKEN = re.compile(
+    r'(?=[()\n/#"])(?:(?P<open>\()|(?P<close>\))|(?P<newline>\n)|(?P<line>//[^\n]*)|(?P<block>/\*)|(?P<literal>#+"(?:"")?|"(?:"")?))'
+)
+_LITERAL_PATTERNS: dict[tuple[int, bool], re.Pattern[str]] = {}
+
+
+def _literal_pattern(hashes: int, multiline: bool) -> re.Pattern[str]:
+    pattern = _LITERAL_PATTERNS.get((hashes, multiline))
+    if pattern is None:
+        escape = re.escape("\\" + "#" * hashes)
+        closing = re.escape(('"""' if multiline else '"') + "#" * hashes)
+        newline = "" if multiline else r"|(?P<newline>\n)"
+        pattern = _LITERAL_PATTERNS[hashes, multiline] = re.compile(
+            rf'(?=[\\"\n])(?:{escape}(?P<interpolation>\()?|(?P<closing>{closing}){newline})'
+        )
+    return pattern
+
+
+def _interpolation_end(text: str, start: int, multiline: bool) -> int:
+    depth = 1
+    pos = start
+    while True:
+        match = _INTERPOLATION_TOKEN.search(text, pos)
+        if match is None:
+            return len(text)
+        kind = match.lastgroup
+        pos = match.end()
+        if kind == "open":
+            depth += 1
+        elif kind == "close":
+            depth -= 1
+            if depth == 0:
+                return pos
+        elif kind == "newline":
+            if not multiline:
+                return match.start()  # unterminated; the string ends with the line
+        elif kind == "block":
+            pos = _block_comment_end(text, match.start())
+        elif kind == "literal":
+            pos = _literal_end(text, match.group(), pos)
+
+
+def _interpolated_literal_end(text: str, start: int, hashes: int, multiline: bool) -> int:
+    pattern = _literal_pattern(hashes, multiline)
+    pos = start
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            return len(text)
+        kind = match.lastgroup
+        if kind == "closing":
+            return match.end()
+        if kind == "newline":
+            return match.start()
+        if kind == "interpolation":
+            pos = _interpolation_end(text, match.end(), multiline)
+        else:
+            pos = match.end() + 1  # the escaped character
+
+
+def _literal_end(text: str, opener: str, start: int) -> int:
+    """End of the string literal opened by opener, whose body starts at start.
+
+    The body patterns handle simple interpolations themselves; a literal they
+    stop short in, or a raw string holding \\#(, is rescanned with the
+    parentheses tracked.
+    """
+    hashes = opener.count("#")
+    multiline = opener.endswith('"""')
+    if hashes:
+        end = _raw_string_end(text, opener, start)
+        if text.find("\\" + "#" * hashes + "(", start, end) == -1:
+            return end
+    else:
+        match = (_MULTILINE_BODY if multiline else _STRING_BODY).match(text, start)
+        if match is not None and not text.startswith("\\(", match.end()):
+            return match.end()
+    return _interpolated_literal_end(text, start, hashes, multiline)
+
+
+def count_lines_in(text: str) -> int:
+    return text.count("\n") + (1 if text and not text.endswith("\n") else 0)
+
+
+@dataclass
+class FilterStats:
+    """Character and line counts for one source, gathered while it is filtered.
+
+    code_chars + kept_comment_chars is the length of the filtered text; the rest
+    of source_chars went with the stripped comments and the blank space around them.
+    """
+
+    source_chars: int = 0
+    code_chars: int = 0
+    kept_comment_chars: int = 0
+    stripped_comment_chars: int = 0
+    source_lines: int = 0
+    lines: int = 0
+
+    @classmethod
+    def unfiltered(cls, text: str) -> FilterStats:
+        lines = count_lines_in(text)
+        return cls(len(text), len(text), 0, 0, lines, lines)
+
+
+def filter_comment_lines(text: str, stats: FilterStats | None = None) -> str:
+    """Strip Swift comments in one pass, keeping those that mention errors or warnings.
+
+    String literals (including multi-line and raw strings) are skipped whole, so
+    "//" inside them is left alone; block comments may nest; trailing comments
+    are removed along with the whitespace before them. Lines that held nothing
+    but removed comments disappear entirely. Interpolations are treated as part
+    of the surrounding string, including any literals nested in them.
+
+    stats, if given, is filled in from the same pass.
+    """
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+
+    kept_comment_chars = stripped_comment_chars = 0
+    pieces: list[str] = []
+    search = _SWIFT_TOKEN_PATTERN.search
+    mentions_keyword = ERROR_WARNING_PATTERN.search
+    blank_rest_of_line = _TRAILING_BLANKS.match
+    flushed = 0
+    pos = 0
+    # True while nothing but removed comments precedes pos on the current line;
+    # that line's indentation waits in pending_indent until code shows up.
+    at_line_start = True
+    pending_indent = ""
+
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        kind = match.lastgroup
+        start = match.start()
+
+        if kind == "string" or kind == "multi" or kind == "raw":
+            pos = _literal_end(text, match.group(), match.end())
+            continue
+
+        end = match.end() if kind == "line" else _block_comment_end(text, start)
+        pos = end
+        if mentions_keyword(text, start, end):
+            kept_comment_chars += end - start
+            continue
+        stripped_comment_chars += end - start
+
+        before = text[flushed:start]
+        head = before.rstrip(" \t")
+        flushed = end
+        if head:
+            pieces.append(pending_indent)
+            pieces.append(head)
+            pending_indent = ""
+            at_line_start = head.endswith("\n")
+        if not at_line_start:
+            # Code on both sides of a block comment must not run together.
+            if kind != "block":
+                continue
+            if "\n" in text[start:end]:
+                if blank_rest_of_line(text, end) is None:
+                    # Carry on with the rest of the code on a line of its own, indented like this one.
+                    line_start = text.rfind("\n", 0, start) + 1
+                    pieces.append("\n" + _LEADING_BLANKS.match(text, line_start).group())
+                    flushed = pos = _LEADING_BLANKS.match(text, end).end()
+            elif text[end : end + 1] not in ("", " ", "\t", "\n") and not pieces[-1].endswith(" "):
+                pieces.append(" ")
+            continue
+
+        rest = blank_rest_of_line(text, end)
+        if rest is not None:
+            # Nothing but removed comments on this line: drop the whole line.
+            flushed = pos = rest.end()
+            pending_indent = ""
+        else:
+            pending_indent += before[len(head):]
+
+    if flushed == 0:
+        content = text
+    else:
+        pieces.append(pending_indent)
+        pieces.append(text[flushed:])
+        content = "".join(pieces)
+    if stats is not None:
+        stats.source_chars = len(text)
+        stats.code_chars = len(content) - kept_comment_chars
+        stats.kept_comment_chars = kept_comment_chars
+        stats.stripped_comment_chars = stripped_comment_chars
+        stats.source_lines = count_lines_in(text)
+        stats.lines = stats.source_lines if content is text else count_lines_in(content)
+    return content
+
+
+def mask_comments_and_strings(text: str) -> str:
+    """Return text with comments and string literals blanked out, newlines kept.
+
+    Offsets into the result match offsets into text, so brace matching and
+    keyword searches can run on the mask and slice the original.
+    """
+    pieces: list[str] = []
+    search = _SWIFT_TOKEN_PATTERN.search
+    flushed = pos = 0
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        kind = match.lastgroup
+        if kind == "string" or kind == "multi" or kind == "raw":
+            end = _literal_end(text, match.group(), match.end())
+        elif kind == "line":
+            end = match.end()
+        else:
+            end = _block_comment_end(text, match.start())
+        pieces.append(text[flushed : match.start()])
+        literal = text[match.start() : end]
+        pieces.append(_NON_NEWLINE.sub(" ", literal) if "\n" in literal else " " * len(literal))
+        flushed = pos = end
+    pieces.append(text[flushed:])
+    return "".join(pieces)
+
+
+_TABLE_TOKENS = re.compile(r"[\[\](){},]")
+_TABLE_TRAILING_COMMA = re.compile(r"\s*\]")
+_TABLE_SUMMARY = re.compile(r"\[/\* [\d,]+ items, [\d,]+ bytes collapsed: table ([0-9a-f]{16}) \*/")
+
+
+class TableStore:
+    """Originals of collapsed tables, one file per table named by its hash.
+
+    Content-addressed, so a table shared by several files or builds is stored
+    once and a stored table never goes stale.
+    """
+
+    def __init__(self, directory: Path = TABLE_STORE_DIR) -> None:
+        self.directory = directory
+
+    def put(self, digest: str, text: str) -> None:
+        path = self.directory / f"{digest}.txt"
+        if path.exists():
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def get(self, digest: str) -> str | None:
+        try:
+            return (self.directory / f"{digest}.txt").read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+
+def _table_spans(masked: str, min_items: int, min_bytes: int) -> list[tuple[int, int, list[int]]]:
+    """(start, end, top-level comma offsets) of the outermost large [...] literals in masked.
+
+    One pass over the brackets and commas. A literal holding braces (closures,
+    code) is never a table, and neither is anything containing one; a literal
+    inside a larger table is absorbed by it.
+    """
+    found: list[tuple[int, int, list[int]]] = []
+    # Open brackets as [opener, start, top-level commas, holds code].
+    stack: list[list] = []
+    for match in _TABLE_TOKENS.finditer(masked):
+        char = match.group()
+        if char == ",":
+            if stack and stack[-1][0] == "[":
+                stack[-1][2].append(match.start())
+        elif char in "[({":
+            stack.append([char, match.start(), [], char == "{"])
+        elif stack:
+            opener, start, commas, holds_code = stack.pop()
+            if holds_code:
+                if stack:
+                    stack[-1][3] = True
+                continue
+            if char != "]" or opener != "[":
+                continue
+            items = len(commas) + 1
+            if commas and _TABLE_TRAILING_COMMA.match(masked, commas[-1] + 1) is not None:
+                items -= 1
+            if items < min_items or match.end() - start < min_bytes:
+                continue
+            while found and found[-1][0] > start:
+                found.pop()
+            found.append((start, match.end(), commas))
+    return found
+
+
+def _table_items(literal: str, commas: Sequence[int], offset: int) -> list[str]:
+    bounds = [offset + 1, *(comma + 1 for comma in commas)]
+    ends = [*commas, offset + len(literal) - 1]
+    items = [literal[start - offset : end - offset] for start, end in zip(bounds, ends)]
+    return items if items[-1].strip() else items[:-1]
+
+
+def _preview(item: str) -> str:
+    item = " ".join(item.split())
+    if "//" in item or "/*" in item:
+        return "…"
+    return item if len(item) <= TABLE_PREVIEW_CHARS else item[: TABLE_PREVIEW_CHARS - 1] + "…"
+
+
+def _table_summary(literal: str, items: Sequence[str], digest: str) -> str:
+    shown = [_preview(item) for item in items[:TABLE_PREVIEW_ITEMS]]
+    shown.append("…")
+    shown.extend(_preview(item) for item in items[-TABLE_PREVIEW_ITEMS:])
+    size = len(literal.encode("utf-8"))
+    return f"[/* {len(items):,} items, {size:,} bytes collapsed: table {digest} */ {', '.join(shown)}]"
+
+
+def collapse_tables(
+    text: str,
+    stats: LoadStats | None = None,
+    store: TableStore | None = None,
+    min_items: int = TABLE_MIN_ITEMS,
+    min_bytes: int = TABLE_MIN_BYTES,
+) -> str:
+    """Replace large array and dictionary literals with a one-line summary.
+
+    A literal qualifies with at least min_items top-level items and min_bytes
+    of text. Its summary gives the item count, size, first and last few items
+    and a hash, under which store keeps the original for expand_tables. The
+    scan is linear in len(text); stats, if given, counts tables and bytes saved.
+    """
+    if text.count(",") < min_items:
+        return text
+    spans = _table_spans(mask_comments_and_strings(text), min_items, min_bytes)
+    if not spans:
+        return text
+    pieces: list[str] = []
+    flushed = saved = 0
+    for start, end, commas in spans:
+        literal = text[start:end]
+        digest = hashlib.sha256(literal.encode("utf-8")).hexdigest()[:16]
+        summary = _table_summary(literal, _table_items(literal, commas, start), digest)
+        if store is not None:
+            store.put(digest, literal)
+        pieces.append(text[flushed:start])
+        pieces.append(summary)
+        saved += len(literal.encode("utf-8")) - len(summary.encode("utf-8"))
+        flushed = end
+    pieces.append(text[flushed:])
+    if stats is not None:
+        stats.tables += len(spans)
+        stats.table_bytes_saved += saved
+    return "".join(pieces)
+
+
+def expand_tables(text: str, store: TableStore) -> tuple[str, list[str]]:
+    """Put the originals of collapsed tables back; returns (text, hashes not in store)."""
+    pieces: list[str] = []
+    missing: list[str] = []
+    flushed = 0
+    for match in _TABLE_SUMMARY.finditer(text):
+        if match.start() < flushed:
+            continue
+        digest = match.group(1)
+        literal = store.get(digest)
+        if literal is None:
+            missing.append(digest)
+            continue
+        spans = _table_spans(mask_comments_and_strings(literal), 0, 0)
+        summary = _table_summary(literal, _table_items(literal, spans[-1][2], 0), digest) if spans else None
+        if summary is None or not text.startswith(summary, match.start()):
+            missing.append(digest)
+            continue
+        pieces.append(text[flushed : match.start()])
+        pieces.append(literal)
+        flushed = match.start() + len(summary)
+    pieces.append(text[flushed:])
+    return "".join(pieces), missing
+
+
+# The lookahead on the keywords' first letters lets the scan skip most positions cheaply.
+_SWIFT_DECLARATION = re.compile(
+    r"(?=[cseapftdi])\b(?:(?P<kind>class|struct|enum|protocol|extension|actor|func|typealias)\s+"
+    r"(?P<name>[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*|`[^`\n]+`|[^\s(<]+)"
+    r"|(?P<init>init|deinit|subscript)\b[?!]?\s*[({<])"
+)
+_TYPE_KINDS = {"class", "struct", "enum", "protocol", "extension", "actor"}
+# Words that continue a declaration header on the next line.
+_HEADER_CONTINUATION = re.compile(r"\s*(?:\{|where\b|->|throws\b|rethrows\b|async\b|[:,&])")
+_LEADING_DECORATION = re.compile(r"[ \t]*(?:@|///|//|/\*|\*)")
+
+
+_SWIFT_BRACKETS = re.compile(r"[{}()\[\]\n]")
+
+
+def _matching_braces(masked: str) -> dict[int, int]:
+    """Map each "{" offset to the offset just past its matching "}"."""
+    closing: dict[int, int] = {}
+    opened: list[int] = []
+    for match in re.finditer(r"[{}]", masked):
+        if match.group() == "{":
+            opened.append(match.start())
+        elif opened:
+            closing[opened.pop()] = match.end()
+    return closing
+
+
+def _declaration_end(masked: str, start: int, closing: dict[int, int]) -> int:
+    """End of the declaration whose header starts at start: its closing brace, or its line."""
+    depth = 0
+    for match in _SWIFT_BRACKETS.finditer(masked, start):
+        char = match.group()
+        pos = match.start()
+        if char in "([":
+            depth += 1
+        elif char in ")]":
+            depth -= 1
+        elif depth > 0:
+            continue
+        elif char == "{":
+            return closing.get(pos, len(masked))
+        elif char == "}":
+            return pos
+        elif not _HEADER_CONTINUATION.match(masked, pos + 1):
+            return pos
+    return len(masked)
+
+
+def _declaration_start(text: str, keyword_start: int) -> int:
+    """Start of the keyword's line, extended up over attribute and doc comment lines."""
+    start = text.rfind("\n", 0, keyword_start) + 1
+    while start > 0:
+        previous = text.rfind("\n", 0, start - 1) + 1
+        if not _LEADING_DECORATION.match(text, previous, start - 1):
+            break
+        start = previous
+    return start
+
+
+def scan_swift_declarations(text: str) -> dict[str, list[tuple[int, int]]]:
+    """Map declared names to the (start, end) offsets of their source in text.
+
+    Covers types, extensions, functions, initialisers, subscripts and type
+    aliases at file level and inside type bodies (not local declarations in
+    function bodies). Members are indexed both by their own name and qualified
+    by their enclosing type ("Type.member"); an extension contributes to its
+    type's name, so "Type" collects the type and all its extensions. Ranges
+    include attributes and doc comments above the declaration and run to the
+    end of its closing line.
+    """
+    masked = mask_comments_and_strings(text)
+    closing = _matching_braces(masked)
+    declarations: list[tuple[int, int, int, str, str]] = []
+    for match in _SWIFT_DECLARATION.finditer(masked):
+        kind = match.group("kind") or match.group("init")
+        name = match.group("name") or match.group("init")
+        name = name.strip("`")
+        end = _declaration_end(masked, match.end(), closing)
+        line_end = text.find("\n", end)
+        end = len(text) if line_end == -1 else line_end
+        declarations.append((match.start(), _declaration_start(text, match.start()), end, kind, name))
+
+    index: dict[str, list[tuple[int, int]]] = {}
+    scopes: list[tuple[int, str | None]] = []  # (end, qualified type name or None for a function)
+    for keyword_start, start, end, kind, name in declarations:
+        while scopes and scopes[-1][0] <= keyword_start:
+            scopes.pop()
+        if scopes and scopes[-1][1] is None:
+            continue
+        qualified = f"{scopes[-1][1]}.{name}" if scopes else name
+        for key in dict.fromkeys((name, qualified)):
+            ranges = index.setdefault(key, [])
+            if (start, end) not in ranges:
+                ranges.append((start, end))
+        scopes.append((end, qualified if kind in _TYPE_KINDS else None))
+    return index
+
+
+class SymbolIndex:
+    """Per-file declaration indexes keyed by the sha256 of the file's text.
+
+    A file is scanned once per distinct content, whatever path it is reached
+    through; with path None the index lives only for this process.
+    """
+
+    def __init__(self, path: Path | None = SYMBOL_INDEX_PATH, max_files: int = SYMBOL_INDEX_MAX_FILES) -> None:
+        self.path = path
+        self.max_files = max_files
+        self.indexes: dict[str, dict[str, list[list[int]]]] = {}
+        self.scans = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None:
+            try:
+                data = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                data = None
+            if isinstance(data, dict) and data.get("version") == SYMBOL_INDEX_VERSION:
+                self.indexes = data.get("indexes", {})
+
+    def lookup(self, text: str) -> dict[str, list[list[int]]]:
+        digest = content_sha256(text)
+        index = self.indexes.get(digest)
+        if index is None:
+            index = {name: [list(span) for span in spans] for name, spans in scan_swift_declarations(text).items()}
+            with self._lock:
+                self.indexes.pop(digest, None)
+                self.indexes[digest] = index
+                self.scans += 1
+                self._dirty = True
+        return index
+
+    def extract(self, path: Path, symbols: Sequence[str]) -> str:
+        """Return the source of the named declarations in path, in file order."""
+        text, _ = _read_text_or_head(path)
+        if text is None:
+            raise ValueError(f"cannot extract symbols from binary file {path}")
+        index = self.lookup(text)
+        spans: set[tuple[int, int]] = set()
+        for symbol in symbols:
+            if symbol not in index:
+                known = ", ".join(sorted(name for name in index if "." not in name)[:20])
+                raise ValueError(f"'{symbol}' is not declared in {path} (declared: {known or 'nothing'})")
+            spans.update((start, end) for start, end in index[symbol])
+        # Drop ranges nested in another selected range.
+        kept: list[tuple[int, int]] = []
+        for start, end in sorted(spans, key=lambda span: (span[0], -span[1])):
+            if not kept or end > kept[-1][1]:
+                kept.append((start, end))
+        return "\n\n".join(text[start:end] for start, end in kept)
+
+    def save(self) -> None:
+        if self.path is None or not self._dirty:
+            return
+        with self._lock:
+            for digest in list(self.indexes)[: max(len(self.indexes) - self.max_files, 0)]:
+                del self.indexes[digest]
+            payload = json.dumps({"version": SYMBOL_INDEX_VERSION, "indexes": self.indexes}, separators=(",", ":"))
+            self._dirty = False
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, self.path)
+
+
+def entry_lookup_path(rel_path: str) -> str:
+    """The path a manifest entry resolves, without its structure: prefix, ::symbols or #options."""
+    if rel_path.startswith(STRUCTURE_PREFIX):
+        return rel_path[len(STRUCTURE_PREFIX):]
+    return rel_path.partition(SYMBOL_SEPARATOR)[0].partition(LISTING_SEPARATOR)[0]
+
+
+def listing_options(rel_path: str) -> dict:
+    """format_directory_listing arguments from a "<dir>#<option>,..." entry.
+
+    Options are depth=N, max=N (0 for no cap), include=<glob>, exclude=<glob>
+    (both repeatable; excludes add to DIRECTORY_LISTING_EXCLUDES) and rollup.
+    """
+    options: dict = {}
+    _, separator, spec = rel_path.partition(LISTING_SEPARATOR)
+    if not separator or rel_path.startswith(STRUCTURE_PREFIX):
+        return options
+    for option in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, value = option.partition("=")
+        if key == "rollup" and not value:
+            options["rollup"] = True
+        elif key in ("depth", "max") and value.isdigit():
+            options["max_depth" if key == "depth" else "max_entries"] = int(value) or None
+        elif key in ("include", "exclude") and value:
+            default = DIRECTORY_LISTING_EXCLUDES if key == "exclude" else ()
+            options[key] = (*options.get(key, default), value)
+        else:
+            raise ValueError(f"Unknown directory listing option '{option}' in '{rel_path}'")
+    return options
+
+
+def filter_comment_lines_by_line(text: str) -> str:
+    """Previous line-based filter, kept as the baseline for the filter benchmark."""
     lines = text.splitlines()
     filtered: list[str] = []
     in_block = False
@@ -107,131 +923,2541 @@ def filter_comment_lines(text: str) -> str:
     return "\n".join(filtered)
 
 
-def describe_binary_file(path: Path) -> str:
-    data = path.read_bytes()
-    digest = hashlib.sha256(data).hexdigest()
-    size_bytes = len(data)
-    preview = " ".join(f"{byte:02x}" for byte in data[:32])
+def content_sha256(text: str) -> str:
+    """Hash of a section body, used to spot identical sections under different paths."""
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def sha256_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as handle:
+        for chunk in iter(lambda: handle.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def looks_binary(head: bytes, complete: bool) -> bool:
+    """Guess from the first bytes of a file whether it is binary.
+
+    complete says whether head is the whole file; if not, a multi-byte UTF-8
+    sequence cut off at the end of head is not counted against it.
+    """
+    if b"\0" in head:
+        return True
+    try:
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=complete)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def describe_binary_file(path: Path, head: bytes | None = None, digest: str | None = None) -> str:
+    """Summarise a binary file without holding it in memory.
+
+    The hash is computed in HASH_CHUNK_SIZE chunks and the preview comes from
+    head (the bytes already sniffed by the caller) when given.
+    """
+    size_bytes = path.stat().st_size
+    if digest is None:
+        digest = sha256_file(path)
+    if head is None or (len(head) < 32 and len(head) < size_bytes):
+        with path.open("rb") as handle:
+            head = handle.read(32)
+    preview = " ".join(f"{byte:02x}" for byte in head[:32])
     lines = [
         "Binary file; contents omitted.",
         f"Size: {size_bytes:,} bytes ({size_bytes / 1024:.2f} KB)",
         f"SHA256: {digest}",
     ]
-    if data:
+    if size_bytes:
         lines.append(f"First 32 bytes (hex): {preview}")
     else:
         lines.append("File is empty.")
     return "\n".join(lines)
 
 
-def format_directory_listing(directory: Path) -> str:
-    entries: list[str] = []
+def _plural(count: int, noun: str) -> str:
+    return f"{count:,} {noun}" if count == 1 else f"{count:,} {noun}s"
+
+
+def _matches_any(rel_path: str, name: str, patterns: Sequence[str]) -> bool:
+    return any(fnmatch(rel_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def format_directory_listing(
+    directory: Path,
+    max_depth: int | None = None,
+    include: Sequence[str] = (),
+    exclude: Sequence[str] = DIRECTORY_LISTING_EXCLUDES,
+    max_entries: int | None = DIRECTORY_LISTING_MAX_ENTRIES,
+    rollup: bool = False,
+) -> str:
+    """List a directory tree depth-first with os.scandir, reusing each DirEntry.
+
+    max_depth counts levels below directory (1 lists only its children).
+    Patterns are fnmatch globs tested against both the relative path and the
+    name: exclude drops files and prunes whole directories, include keeps only
+    matching files (and hides directories left with none). Past max_entries the
+    walk continues only to count what was left out. rollup annotates every
+    directory with the file count and total size beneath it, including levels
+    below max_depth. Symlinked directories are listed but not followed.
+    """
     directory = directory.resolve()
-    sorted_entries = sorted(
-        directory.rglob("*"), key=lambda p: p.relative_to(directory).as_posix()
-    )
+    lines: list[str | None] = []
+    hidden = 0
 
-    for entry in sorted_entries:
-        rel = entry.relative_to(directory)
-        rel_str = rel.as_posix()
-        if entry.is_dir():
-            entries.append(f"{rel_str}/")
-        else:
-            size_bytes = entry.stat().st_size
-            entries.append(f"{rel_str} ({size_bytes:,} bytes)")
+    def has_room() -> bool:
+        return max_entries is None or len(lines) < max_entries
 
-    if not entries:
-        return "(directory is empty)"
+    def walk(path: str, prefix: str, depth: int) -> tuple[int, int]:
+        nonlocal hidden
+        file_count = total_size = 0
+        try:
+            with os.scandir(path) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            return 0, 0
+        listed = max_depth is None or depth <= max_depth
 
-    lines = ["Directory listing (relative paths):"]
-    lines.extend(f"- {item}" for item in entries)
-    return "\n".join(lines)
+        for entry in entries:
+            rel_path = prefix + entry.name
+            if exclude and _matches_any(rel_path, entry.name, exclude):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
 
+            if not is_dir:
+                if include and not _matches_any(rel_path, entry.name, include):
+                    continue
+                try:
+                    size_bytes = entry.stat().st_size
+                except OSError:
+                    size_bytes = 0
+                file_count += 1
+                total_size += size_bytes
+                if listed and has_room():
+                    lines.append(f"{rel_path} ({size_bytes:,} bytes)")
+                elif listed:
+                    hidden += 1
+                continue
 
-def load_source_content(path: Path) -> str:
-    if path.is_dir():
-        return format_directory_listing(path)
+            slot = None
+            if listed and has_room():
+                slot = len(lines)
+                lines.append(None)
+            elif listed:
+                hidden += 1
+
+            descend = not entry.is_symlink() and (
+                rollup or max_depth is None or depth < max_depth
+            )
+            if not descend:
+                if slot is not None:
+                    lines[slot] = f"{rel_path}/"
+                continue
+
+            sub_files, sub_size = walk(entry.path, rel_path + "/", depth + 1)
+            file_count += sub_files
+            total_size += sub_size
+            if include and not sub_files:
+                if slot is not None:
+                    del lines[slot:]
+                elif listed:
+                    hidden -= 1
+            elif slot is not None:
+                lines[slot] = (
+                    f"{rel_path}/ ({_plural(sub_files, 'file')}, {sub_size:,} bytes)" if rollup else f"{rel_path}/"
+                )
+        return file_count, total_size
+
+    file_count, total_size = walk(str(directory), "", 1)
+
+    if not lines and not hidden:
+        return "(no entries match)" if include else "(directory is empty)"
+
+    output = ["Directory listing (relative paths):"]
+    if rollup:
+        output.append(f"Total: {_plural(file_count, 'file')}, {total_size:,} bytes")
+    output.extend(f"- {line}" for line in lines)
+    if hidden:
+        output.append(f"- ... {hidden:,} more entries (listing capped at {max_entries:,})")
+    return "\n".join(output)
+
+
+def count_lines(path: str) -> int | None:
+    """Count lines in a text file by scanning chunks; None for binary files."""
+    lines = 0
+    last = b"\n"
+    with open(path, "rb") as handle:
+        head = handle.read(BINARY_SNIFF_SIZE)
+        complete = len(head) < BINARY_SNIFF_SIZE
+        if looks_binary(head, complete):
+            return None
+        chunk = head
+        while chunk:
+            lines += chunk.count(b"\n")
+            last = chunk[-1:]
+            chunk = handle.read(HASH_CHUNK_SIZE)
+    return lines + (last != b"\n")
+
+
+_GLOB_CHARACTERS = re.compile(r"[*?[]")
+
+
+def glob_base(pattern: str) -> str:
+    """The literal directory prefix of a glob pattern ("" if it starts with a wildcard)."""
+    parts = pattern.split("/")
+    literal = next((index for index, part in enumerate(parts) if _GLOB_CHARACTERS.search(part)), len(parts))
+    return "/".join(parts[:literal])
+
+
+class StructureCache:
+    """Generates project structure trees and expands globs, caching what each walk learns.
+
+    A directory's entry list is reused while its mtime is unchanged, and a
+    file's line count while its mtime and size are, so an unchanged tree costs
+    one stat per entry and no reads. With path None nothing is persisted.
+    """
+
+    def __init__(
+        self,
+        path: Path | None = STRUCTURE_CACHE_PATH,
+        exclude: Sequence[str] = STRUCTURE_EXCLUDES,
+        max_entries: int = STRUCTURE_CACHE_MAX_ENTRIES,
+    ) -> None:
+        self.path = path
+        self.exclude = exclude
+        self.max_entries = max_entries
+        # directory -> [mtime_ns, [[name, is_dir, is_symlink], ...]]; file -> [mtime_ns, size, lines]
+        self.directories: dict[str, list] = {}
+        self.files: dict[str, list] = {}
+        self._touched: set[str] = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None:
+            self._read()
+
+    def _read(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == STRUCTURE_CACHE_VERSION:
+            self.directories = data.get("directories", {})
+            self.files = data.get("files", {})
+
+    def _entries(self, directory: str) -> list[list]:
+        self._touched.add(directory)
+        mtime_ns = os.stat(directory).st_mtime_ns
+        cached = self.directories.get(directory)
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        entries = []
+        with os.scandir(directory) as iterator:
+            for entry in iterator:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries.append([entry.name, is_dir, entry.is_symlink()])
+        entries.sort()
+        self.directories[directory] = [mtime_ns, entries]
+        self._dirty = True
+        return entries
+
+    def _file_summary(self, path: str) -> str:
+        self._touched.add(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return ""
+        cached = self.files.get(path)
+        if cached is None or cached[0] != stat.st_mtime_ns or cached[1] != stat.st_size:
+            try:
+                lines = count_lines(path)
+            except OSError:
+                lines = None
+            cached = self.files[path] = [stat.st_mtime_ns, stat.st_size, lines]
+            self._dirty = True
+        if cached[2] is None:
+            return f" ({cached[1]:,} bytes)"
+        return f" ({cached[1]:,} bytes, {_plural(cached[2], 'line')})"
+
+    def render(self, root: Path, label: str) -> str:
+        """Return the tree under root as indented "- name" lines, headed by label."""
+        lines = [f"- {label}"]
+
+        def walk(directory: str, indent: str) -> None:
+            for name, is_dir, is_symlink in self._entries(directory):
+                if _matches_any(name, name, self.exclude):
+                    continue
+                path = os.path.join(directory, name)
+                if is_dir and not is_symlink:
+                    lines.append(f"{indent}- {name}")
+                    walk(path, indent + "  ")
+                else:
+                    lines.append(f"{indent}- {name}{self._file_summary(path)}")
+
+        walk(str(root.resolve()), "  ")
+        return "\n".join(lines)
+
+    def glob(self, root: Path, pattern: str) -> list[str]:
+        """Return the files under root matching pattern as sorted relative paths.
+
+        Each "/"-separated part is matched case-sensitively with fnmatch; "**"
+        spans any number of directories (but does not follow symlinks into
+        them) and a trailing "**" matches every file below. The structure
+        excludes do not apply here.
+        """
+        parts = [part for part in pattern.split("/") if part not in ("", ".")]
+        if parts[-1:] == ["**"]:
+            parts.append("*")
+        matches: list[str] = []
+
+        def walk(directory: str, prefix: str, index: int) -> None:
+            part = parts[index]
+            last = index == len(parts) - 1
+            if part == "**":
+                walk(directory, prefix, index + 1)
+                for name, is_dir, is_symlink in self._entries(directory):
+                    if is_dir and not is_symlink:
+                        walk(os.path.join(directory, name), f"{prefix}{name}/", index)
+            elif not _GLOB_CHARACTERS.search(part):
+                # Probed rather than listed; noted so a fingerprint sees the part appear.
+                self._touched.add(directory)
+                path = os.path.join(directory, part)
+                if last and os.path.isfile(path):
+                    matches.append(prefix + part)
+                elif not last and os.path.isdir(path):
+                    walk(path, f"{prefix}{part}/", index + 1)
+            else:
+                for name, is_dir, _ in self._entries(directory):
+                    if fnmatchcase(name, part):
+                        if last and not is_dir:
+                            matches.append(prefix + name)
+                        elif not last and is_dir:
+                            walk(os.path.join(directory, name), f"{prefix}{name}/", index + 1)
+
+        if parts and os.path.isdir(root):
+            walk(str(root), "", 0)
+        return sorted(set(matches))
+
+    def save(self) -> None:
+        """Write the cache, keeping what other targets' trees and globs cached.
+
+        Entries this process did not touch are only dropped, oldest first, once
+        there are more than max_entries directories and files in all.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            excess = len(self.directories) + len(self.files) - self.max_entries
+            if excess > 0:
+                stale = [key for key in (*self.directories, *self.files) if key not in self._touched][:excess]
+                for key in stale:
+                    self.directories.pop(key, None)
+                    self.files.pop(key, None)
+                self._dirty = self._dirty or bool(stale)
+            if not self._dirty:
+                return
+            payload = json.dumps({"version": STRUCTURE_CACHE_VERSION, "directories": self.directories, "files": self.files})
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.name + ".tmp")
+            tmp_path.write_text(payload, encoding="utf-8")
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+
+@dataclass
+class LoadStats:
+    """Timings and cache status recorded while loading one source."""
+
+    load_seconds: float = 0.0
+    filter_seconds: float = 0.0
+    cache_hit: bool | None = None
+    content_sha256: str | None = None
+    filter_stats: FilterStats = field(default_factory=FilterStats)
+    tables: int = 0
+    table_bytes_saved: int = 0
+
+    @property
+    def filtered_chars(self) -> int:
+        counts = self.filter_stats
+        return counts.source_chars - counts.code_chars - counts.kept_comment_chars
+
+
+class FileStats(NamedTuple):
+    rel_path: str
+    chars: int
+    bytes: int
+    resolve_seconds: float = 0.0
+    load_seconds: float = 0.0
+    filter_seconds: float = 0.0
+    cache_hit: bool | None = None
+    tokens: int = 0
+    cut_tokens: int = 0
+    duplicate_of: str | None = None
+    saved_bytes: int = 0
+    comment_chars: int = 0
+    filtered_chars: int = 0
+    root: str | None = None
+    source_chars: int = 0
+    code_chars: int = 0
+    stripped_comment_chars: int = 0
+    source_lines: int = 0
+    lines: int = 0
+    tables: int = 0
+    table_bytes_saved: int = 0
+
+
+def _read_text_or_head(path: Path) -> tuple[str | None, bytes]:
+    """Return (text, head), with text None when the file is binary.
+
+    Only the first BINARY_SNIFF_SIZE bytes are read for files that look binary;
+    the rest of a text file is read from the same handle.
+    """
+    with path.open("rb") as handle:
+        head = handle.read(BINARY_SNIFF_SIZE)
+        complete = len(head) < BINARY_SNIFF_SIZE
+        if looks_binary(head, complete):
+            return None, head
+        data = head if complete else head + handle.read()
     try:
-        text = path.read_text(encoding="utf-8")
+        text = data.decode("utf-8")
     except UnicodeDecodeError:
-        return describe_binary_file(path)
-    return filter_comment_lines(text)
+        return None, head
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text, head
+
+
+def load_source_content(
+    path: Path,
+    stats: LoadStats | None = None,
+    filter_text: Callable[[str, FilterStats | None], str] = filter_comment_lines,
+    digest: str | None = None,
+) -> str:
+    """Return the section body for path: a listing, a binary summary or filtered text.
+
+    digest, when the caller has already hashed the file, saves describe_binary_file
+    a second read.
+    """
+    started = time.perf_counter()
+    if path.is_dir():
+        content = format_directory_listing(path)
+        if stats is not None:
+            stats.load_seconds = time.perf_counter() - started
+            stats.filter_stats = FilterStats.unfiltered(content)
+        return content
+    text, head = _read_text_or_head(path)
+    if text is None:
+        content = describe_binary_file(path, head, digest)
+        if stats is not None:
+            stats.load_seconds = time.perf_counter() - started
+            stats.filter_stats = FilterStats.unfiltered(content)
+        return content
+    loaded = time.perf_counter()
+    content = filter_text(text, stats.filter_stats if stats is not None else None)
+    if stats is not None:
+        stats.load_seconds = loaded - started
+        stats.filter_seconds = time.perf_counter() - loaded
+    return content
+
+
+def _ignore(content: str) -> None:
+    pass
+
+
+class ContentCache:
+    """Persistent cache of load_source_content output keyed by mtime, size and sha256.
+
+    A file whose mtime and size are unchanged is served without being read. If only
+    the mtime moved (checkout, touch), the content hash decides whether the cached
+    output is still valid. Directory listings are never cached.
+
+    The index (path) holds only the keys and stats; each filtered body is a
+    file of its own in a directory next to it, named by its content hash, and
+    is read when it is served. A warm build therefore neither loads every body
+    nor rewrites the index: a hit only refreshes last_used once it is
+    CONTENT_CACHE_LAST_USED_RESOLUTION old.
+    """
+
+    def __init__(
+        self,
+        path: Path = CONTENT_CACHE_PATH,
+        max_entries: int = CONTENT_CACHE_MAX_ENTRIES,
+        max_chars: int = CONTENT_CACHE_MAX_CHARS,
+    ) -> None:
+        self.path = path
+        self.bodies = path.with_suffix("")
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.entries: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self._touched: set[str] = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._read()
+
+    def _read(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == CONTENT_CACHE_VERSION:
+            self.entries = data.get("entries", {})
+
+    def _body_path(self, content_digest: str) -> Path:
+        return self.bodies / f"{content_digest}.txt"
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def load_source_content(
+        self,
+        path: Path,
+        stats: LoadStats | None = None,
+        filter_text: Callable[[str, FilterStats | None], str] = filter_comment_lines,
+    ) -> str:
+        if path.is_dir():
+            return load_source_content(path, stats, filter_text)
+
+        if stats is None:
+            stats = LoadStats()
+        content, remember, digest = self.lookup(path, stats)
+        if content is None:
+            content = load_source_content(path, stats, filter_text, digest)
+            remember(content)
+        return content
+
+    def lookup(
+        self, path: Path, stats: LoadStats, source_stat: tuple[int, int] | None = None
+    ) -> tuple[str | None, Callable[[str], None], str | None]:
+        """Return (cached content or None, a callback that caches freshly loaded content, source sha256).
+
+        The split lets a pipeline read and filter the file between the two halves.
+        source_stat is the file's (mtime_ns, size) if the caller has just taken it.
+        """
+        started = time.perf_counter()
+        key = str(path.resolve())
+        if source_stat is None:
+            stat = path.stat()
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        else:
+            mtime_ns, size = source_stat
+        with self._lock:
+            self._touched.add(key)
+            entry = self.entries.get(key)
+
+        digest = None
+        if entry is not None and entry["size"] == size:
+            if entry["mtime_ns"] != mtime_ns:
+                digest = sha256_file(path)
+            if digest is None or entry["sha256"] == digest:
+                content = self._hit(entry, stats, started)
+                if content is not None:
+                    if digest is not None:
+                        with self._lock:
+                            entry["mtime_ns"] = mtime_ns
+                            self._dirty = True
+                    return content, _ignore, entry["sha256"]
+        if digest is None:
+            digest = sha256_file(path)
+
+        def remember(content: str) -> None:
+            stats.cache_hit = False
+            content_digest = content_sha256(content)
+            body_path = self._body_path(content_digest)
+            if not body_path.exists():
+                self.bodies.mkdir(parents=True, exist_ok=True)
+                tmp_path = body_path.with_name(f".{body_path.name}.{threading.get_ident()}.tmp")
+                tmp_path.write_bytes(content.encode("utf-8", "surrogatepass"))
+                os.replace(tmp_path, body_path)
+            with self._lock:
+                self.misses += 1
+                self.entries[key] = {
+                    "mtime_ns": mtime_ns,
+                    "size": size,
+                    "sha256": digest,
+                    "content_sha256": content_digest,
+                    "chars": len(content),
+                    "filter_stats": asdict(stats.filter_stats),
+                    "last_used": time.time(),
+                }
+                self._dirty = True
+            stats.content_sha256 = content_digest
+
+        return None, remember, digest
+
+    def _hit(self, entry: dict, stats: LoadStats | None, started: float) -> str | None:
+        """The cached body for entry, or None if its file has gone missing."""
+        try:
+            content = self._body_path(entry["content_sha256"]).read_bytes().decode("utf-8", "surrogatepass")
+        except OSError:
+            return None
+        if stats is not None:
+            stats.load_seconds = time.perf_counter() - started
+            stats.cache_hit = True
+            stats.content_sha256 = entry["content_sha256"]
+            stats.filter_stats = FilterStats(**entry["filter_stats"])
+        now = time.time()
+        with self._lock:
+            self.hits += 1
+            if now - entry["last_used"] >= CONTENT_CACHE_LAST_USED_RESOLUTION:
+                entry["last_used"] = now
+                self._dirty = True
+        return content
+
+    def prune(self, listed: Callable[[], Iterable[str]] | None = None) -> int:
+        """Drop entries for files that are no longer listed, then enforce the size bounds.
+
+        listed returns the keys (resolved paths) of every file some bundle still
+        lists, see source_cache_keys; it is only called if this process left
+        entries unrequested. Without it, only the requested files are kept.
+        Bodies no remaining entry refers to are deleted.
+        """
+        untouched = [key for key in self.entries if key not in self._touched]
+        if untouched and listed is not None:
+            keep = set(listed())
+            untouched = [key for key in untouched if key not in keep]
+        dropped = [self.entries.pop(key) for key in untouched]
+
+        total_chars = sum(entry["chars"] for entry in self.entries.values())
+        by_age = sorted(self.entries, key=lambda key: self.entries[key]["last_used"])
+        for key in by_age:
+            if len(self.entries) <= self.max_entries and total_chars <= self.max_chars:
+                break
+            dropped.append(self.entries.pop(key))
+            total_chars -= dropped[-1]["chars"]
+
+        if dropped:
+            self._dirty = True
+            kept = {entry["content_sha256"] for entry in self.entries.values()}
+            for content_digest in {entry["content_sha256"] for entry in dropped} - kept:
+                try:
+                    self._body_path(content_digest).unlink()
+                except OSError:
+                    pass
+        return len(dropped)
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = json.dumps({"version": CONTENT_CACHE_VERSION, "entries": self.entries})
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(payload, encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+
+
+def _temp_sibling(path: Path) -> Path:
+    return path.with_name(f".{path.name}.tmp")
+
+
+class DestinationStatus(NamedTuple):
+    path: Path
+    status: str  # "written", "unchanged" or "failed"
+    detail: str = ""
+
+
+def _fsync_directory(directory: Path) -> None:
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _same_contents(path: Path, reference: Path, size: int) -> bool:
+    """Whether path holds the same size bytes as reference, compared directly rather than hashed."""
+    try:
+        if path.stat().st_size != size:
+            return False
+        with path.open("rb") as handle, reference.open("rb") as expected:
+            while True:
+                chunk = handle.read(HASH_CHUNK_SIZE)
+                if chunk != expected.read(HASH_CHUNK_SIZE):
+                    return False
+                if not chunk:
+                    return True
+    except OSError:
+        return False
+
+
+def _copy_to_destination(source: Path, destination: Path, size: int, fsync: bool) -> DestinationStatus:
+    """Publish source at destination via a temp sibling, unless it already holds the same bytes."""
+    if _same_contents(destination, source, size):
+        return DestinationStatus(destination, "unchanged")
+    temp_path = _temp_sibling(destination)
+    try:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        import shutil
+
+        with source.open("rb") as reader, temp_path.open("wb") as writer:
+            shutil.copyfileobj(reader, writer, HASH_CHUNK_SIZE)
+            if fsync:
+                writer.flush()
+                os.fsync(writer.fileno())
+        os.replace(temp_path, destination)
+        if fsync:
+            _fsync_directory(destination.parent)
+    except OSError as error:
+        try:
+            temp_path.unlink()
+        except OSError:
+            pass
+        return DestinationStatus(destination, "failed", str(error))
+    return DestinationStatus(destination, "written")
+
+
+class BundleWriter:
+    """Streams chunks to a temporary primary output, then publishes it.
+
+    Each chunk is encoded once, hashed for the integrity record (into
+    chunk_sha256s) and written as it arrives, and the character and byte
+    totals are accumulated per chunk, so nothing larger than a single section
+    is held in memory. On a clean close the temporary file is renamed over the
+    primary output, or discarded if the existing output already has the same
+    bytes (so its mtime is left alone); leaving the with block on an exception
+    discards it and keeps the previous output. Secondary copies are then
+    published concurrently the same way, best-effort. With fsync, files and
+    their directories are flushed to disk before and after each rename. The
+    outcome for every path is recorded in destinations.
+    """
+
+    def __init__(
+        self, output_path: Path, secondary_output_paths: Iterable[Path] = (), fsync: bool = False
+    ) -> None:
+        self.output_path = output_path
+        self.secondary_output_paths = list(secondary_output_paths)
+        self.fsync = fsync
+        self.total_chars = 0
+        self.total_bytes = 0
+        self.destinations: list[DestinationStatus] = []
+        self.chunk_sha256s: list[str] = []
+        self._primary = _temp_sibling(output_path).open("wb")
+
+    def write(self, chunk: str) -> tuple[int, int]:
+        """Write chunk; return its char and byte counts."""
+        data = chunk.encode("utf-8")
+        self._primary.write(data)
+        self.chunk_sha256s.append(hashlib.sha256(data).hexdigest())
+        self.total_chars += len(chunk)
+        self.total_bytes += len(data)
+        return len(chunk), len(data)
+
+    def close(self, commit: bool = True) -> None:
+        temp_path = Path(self._primary.name)
+        if commit and self.fsync:
+            self._primary.flush()
+            os.fsync(self._primary.fileno())
+        self._primary.close()
+        if not commit or _same_contents(self.output_path, temp_path, self.total_bytes):
+            temp_path.unlink()
+            if commit:
+                self.destinations.append(DestinationStatus(self.output_path, "unchanged"))
+        else:
+            os.replace(temp_path, self.output_path)
+            if self.fsync:
+                _fsync_directory(self.output_path.parent)
+            self.destinations.append(DestinationStatus(self.output_path, "written"))
+        if not commit or not self.secondary_output_paths:
+            return
+
+        def publish(destination: Path) -> DestinationStatus:
+            return _copy_to_destination(self.output_path, destination, self.total_bytes, self.fsync)
+
+        if len(self.secondary_output_paths) == 1:
+            self.destinations.append(publish(self.secondary_output_paths[0]))
+        else:
+            from concurrent.futures import ThreadPoolExecutor
+
+            with ThreadPoolExecutor(max_workers=len(self.secondary_output_paths)) as pool:
+                self.destinations.extend(pool.map(publish, self.secondary_output_paths))
+
+    def __enter__(self) -> BundleWriter:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: object) -> None:
+        self.close(commit=exc_type is None)
+
+
+_ARCHIVE_MAGIC = b"CONCATIX"
+# index offset, index length, magic
+_ARCHIVE_TRAILER = struct.Struct("<QQ8s")
+
+
+class ArchiveWriter:
+    """Writes sections as separate gzip members followed by a JSON index.
+
+    The index lists, in bundle order, each section's path, offset and length
+    of its compressed member, sha256 and char count of the section text. A
+    fixed-size trailer at the end of the file locates the index, so a reader
+    can fetch any section without decompressing the others. Concatenated gzip
+    members are themselves valid gzip, so `zcat` still prints every section
+    (without the blank separator lines, and with a warning about the trailing
+    index). Written atomically like BundleWriter.
+    """
+
+    def __init__(self, path: Path, level: int = ARCHIVE_COMPRESSION_LEVEL) -> None:
+        self.path = path
+        self.level = level
+        self.sections: list[dict] = []
+        self.compressed_bytes = 0
+        self._handle = _temp_sibling(path).open("wb")
+
+    def add(self, rel_path: str, section: str) -> None:
+        import zlib
+
+        data = section.encode("utf-8")
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        frame = compressor.compress(data) + compressor.flush()
+        self.sections.append({
+            "path": rel_path,
+            "offset": self.compressed_bytes,
+            "length": len(frame),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "chars": len(section),
+        })
+        self._handle.write(frame)
+        self.compressed_bytes += len(frame)
+
+    def close(self, commit: bool = True) -> None:
+        if commit:
+            index = json.dumps({"version": 1, "sections": self.sections}).encode("utf-8")
+            self._handle.write(index)
+            self._handle.write(_ARCHIVE_TRAILER.pack(self.compressed_bytes, len(index), _ARCHIVE_MAGIC))
+        self._handle.close()
+        if commit:
+            os.replace(self._handle.name, self.path)
+        else:
+            os.unlink(self._handle.name)
+
+    def __enter__(self) -> ArchiveWriter:
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: object) -> None:
+        self.close(commit=exc_type is None)
+
+
+class BundleArchive:
+    """Random-access reader for archives written by ArchiveWriter.
+
+    The file is memory-mapped and only the index is parsed up front; section()
+    then decompresses just the one member it needs.
+    """
+
+    def __init__(self, path: Path) -> None:
+        import mmap
+
+        self.path = path
+        with path.open("rb") as handle:
+            self._map = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self._map) < _ARCHIVE_TRAILER.size:
+                raise ValueError(f"{path} is too short to be a bundle archive")
+            offset, length, magic = _ARCHIVE_TRAILER.unpack_from(self._map, len(self._map) - _ARCHIVE_TRAILER.size)
+            if magic != _ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a bundle archive")
+            index = json.loads(self._map[offset : offset + length])
+        except BaseException:
+            self._map.close()
+            raise
+        self.sections: list[dict] = index["sections"]
+        self._by_path: dict[str, dict] = {}
+        for entry in self.sections:
+            self._by_path.setdefault(entry["path"], entry)
+
+    def paths(self) -> list[str]:
+        return [entry["path"] for entry in self.sections]
+
+    def entry(self, rel_path: str) -> dict:
+        try:
+            return self._by_path[rel_path]
+        except KeyError:
+            raise KeyError(f"no section for '{rel_path}' in {self.path}") from None
+
+    def section(self, rel_path: str) -> str:
+        import zlib
+
+        entry = self.entry(rel_path)
+        frame = self._map[entry["offset"] : entry["offset"] + entry["length"]]
+        return zlib.decompress(frame, 31).decode("utf-8")
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> BundleArchive:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+
+class BundleResult(NamedTuple):
+    path: Path
+    total_chars: int
+    comment_chars: int
+    total_bytes: int
+    per_file_stats: list[FileStats]
+    destinations: list[DestinationStatus]
+    pipeline: PipelineStats | None = None
+
+
+class LoadedSection(NamedTuple):
+    rel_path: str
+    section: str
+    resolve_seconds: float
+    stats: LoadStats
+    digest: str = ""
+    root: str | None = None
+    path: Path | None = None
+    source_stat: tuple[int, int] | None = None  # (mtime_ns, size) of a file source, taken before reading
+
+
+class ResolvedEntry(NamedTuple):
+    rel_path: str
+    path: Path
+    root: str | None
+    resolve_seconds: float
+    size: int  # bytes the read stage is expected to hold; 0 for generated sections
+    mtime_ns: int | None = None  # set for file sources
+
+
+class ReadEntry(NamedTuple):
+    """An entry after the read stage: either a finished body or raw input still to process."""
+
+    resolved: ResolvedEntry
+    stats: LoadStats
+    contents: str | None = None
+    text: str | None = None
+    head: bytes = b""
+    digest: str | None = None
+    remember: Callable[[str], None] = _ignore
+
+
+def resolve_entry(repo_root: Path, rel_path: str, resolver: SourceResolver | None = None) -> ResolvedEntry:
+    started = time.perf_counter()
+    lookup_path = entry_lookup_path(rel_path)
+    root = None
+    if resolver is not None:
+        root, source_path = resolver.resolve_with_root(lookup_path)
+    else:
+        source_path = resolve_source_path(repo_root, lookup_path)
+    size = 0
+    mtime_ns = None
+    if not rel_path.startswith(STRUCTURE_PREFIX):
+        try:
+            stat = source_path.stat()
+        except OSError:
+            pass
+        else:
+            if not S_ISDIR(stat.st_mode):
+                size, mtime_ns = stat.st_size, stat.st_mtime_ns
+    return ResolvedEntry(rel_path, source_path, str(root) if root is not None else None, time.perf_counter() - started, size, mtime_ns)
+
+
+def read_entry(
+    resolved: ResolvedEntry,
+    cache: ContentCache | None = None,
+    structures: StructureCache | None = None,
+    symbols: SymbolIndex | None = None,
+) -> ReadEntry:
+    """The I/O half of loading an entry: cache lookup, file read, listing or structure walk.
+
+    "structure:<dir>" entries become a generated tree of <dir>,
+    "<file>::<Name>[,<Name>...]" entries just the named Swift declarations, and
+    "<dir>#<option>,..." entries a listing shaped by listing_options.
+    """
+    rel_path, path = resolved.rel_path, resolved.path
+    stats = LoadStats()
+    started = time.perf_counter()
+    if rel_path.startswith(STRUCTURE_PREFIX):
+        contents = (structures or StructureCache(None)).render(path, Path(rel_path[len(STRUCTURE_PREFIX):]).name)
+    elif SYMBOL_SEPARATOR in rel_path:
+        names = [name.strip() for name in rel_path[len(entry_lookup_path(rel_path)) + len(SYMBOL_SEPARATOR):].split(",")]
+        text = (symbols or SymbolIndex(None)).extract(path, names)
+        stats.load_seconds = time.perf_counter() - started
+        return ReadEntry(resolved, stats, text=text)
+    elif resolved.mtime_ns is None and path.is_dir():
+        contents = format_directory_listing(path, **listing_options(rel_path))
+    else:
+        remember, digest = _ignore, None
+        if cache is not None:
+            source_stat = (resolved.mtime_ns, resolved.size) if resolved.mtime_ns is not None else None
+            cached, remember, digest = cache.lookup(path, stats, source_stat)
+            if cached is not None:
+                return ReadEntry(resolved, stats, cached)
+        text, head = _read_text_or_head(path)
+        stats.load_seconds = time.perf_counter() - started
+        return ReadEntry(resolved, stats, None, text, head, digest, remember)
+    stats.load_seconds = time.perf_counter() - started
+    stats.filter_stats = FilterStats.unfiltered(contents)
+    return ReadEntry(resolved, stats, contents)
+
+
+def finish_entry(
+    read: ReadEntry | LoadedSection,
+    filter_text: Callable[[str, FilterStats | None], str] = filter_comment_lines,
+    tables: TableStore | None = None,
+) -> LoadedSection:
+    """The CPU half: filter text or describe a binary, then wrap the body in its section header.
+
+    With tables, large data literals are then collapsed (see collapse_tables).
+    That happens after the content cache, so cached entries serve either way.
+    """
+    if isinstance(read, LoadedSection):
+        return read
+    resolved, stats, contents = read.resolved, read.stats, read.contents
+    if contents is None:
+        started = time.perf_counter()
+        if read.text is not None:
+            contents = filter_text(read.text, stats.filter_stats)
+            stats.filter_seconds = time.perf_counter() - started
+        else:
+            contents = describe_binary_file(resolved.path, read.head, read.digest)
+            stats.filter_stats = FilterStats.unfiltered(contents)
+            stats.load_seconds += time.perf_counter() - started
+        read.remember(contents)
+    digest = stats.content_sha256 or content_sha256(contents)
+    if tables is not None:
+        started = time.perf_counter()
+        contents = collapse_tables(contents, stats, tables)
+        stats.filter_seconds += time.perf_counter() - started
+    section = f"==== {resolved.rel_path} ====\n\n{contents.rstrip()}\n"
+    source_stat = (resolved.mtime_ns, resolved.size) if resolved.mtime_ns is not None else None
+    return LoadedSection(resolved.rel_path, section, resolved.resolve_seconds, stats, digest, resolved.root, resolved.path, source_stat)
+
+
+def load_section(
+    repo_root: Path,
+    rel_path: str,
+    cache: ContentCache | None = None,
+    filter_text: Callable[[str, FilterStats | None], str] = filter_comment_lines,
+    resolver: SourceResolver | None = None,
+    structures: StructureCache | None = None,
+    symbols: SymbolIndex | None = None,
+    tables: TableStore | None = None,
+) -> LoadedSection:
+    """Resolve, read and filter one manifest entry into its output section (all stages in turn)."""
+    resolved = resolve_entry(repo_root, rel_path, resolver)
+    return finish_entry(read_entry(resolved, cache, structures, symbols), filter_text, tables)
+
+
+PIPELINE_MEMORY_CAP = 256 * 1024 * 1024
+PIPELINE_BATCH_ITEMS = 16
+
+
+@dataclass
+class StageStats:
+    """How one pipeline stage spent its time; seconds are summed over its workers."""
+
+    name: str
+    workers: int = 1
+    items: int = 0
+    busy_seconds: float = 0.0
+    starved_seconds: float = 0.0  # waiting for input
+    blocked_seconds: float = 0.0  # waiting for room downstream (or, for the first stage, memory)
+    max_queue: int = 0  # deepest its input queue got, in batches
+
+
+@dataclass
+class PipelineStats:
+    stages: list[StageStats] = field(default_factory=list)
+    memory_cap: int = 0
+    peak_bytes: int = 0
+
+
+class _Failed(NamedTuple):
+    error: BaseException
+
+
+def _held_bytes(value: object) -> int:
+    if isinstance(value, ResolvedEntry):
+        return value.size
+    if isinstance(value, ReadEntry):
+        # head only matters (for describe_binary_file) when there is no text.
+        return len(value.contents or value.text or value.head)
+    if isinstance(value, LoadedSection):
+        return len(value.section)
+    return 0
+
+
+def _needs_worker(value: object) -> bool:
+    return not isinstance(value, LoadedSection) and not (isinstance(value, ReadEntry) and value.contents is not None)
+
+
+class _MemoryBudget:
+    """Admission control for the pipeline: bytes held by entries between admission and write.
+
+    Only the pipeline's loop touches it; there is a single acquirer (admission).
+    """
+
+    def __init__(self, cap: int, stats: PipelineStats) -> None:
+        self.cap = cap
+        self.used = 0
+        import asyncio
+
+        self.stats = stats
+        self._released = asyncio.Event()
+
+    def fits(self, size: int) -> bool:
+        # An entry larger than the whole cap still fits once nothing else is held.
+        return not self.used or self.used + size <= self.cap
+
+    async def acquire(self, size: int) -> None:
+        while not self.fits(size):
+            self._released.clear()
+            await self._released.wait()
+        self.resize(0, size)
+
+    def resize(self, old: int, new: int) -> None:
+        self.used += new - old
+        self.stats.peak_bytes = max(self.stats.peak_bytes, self.used)
+        if new < old:
+            self._released.set()
+
+    def release(self, size: int) -> None:
+        self.resize(size, 0)
+
+
+def _apply(func: Callable, values: list) -> list:
+    results = []
+    for value in values:
+        if not isinstance(value, _Failed):
+            try:
+                value = func(value)
+            except Exception as error:
+                value = _Failed(error)
+        results.append(value)
+    return results
+
+
+def _batch_size(items: int, workers: int) -> int:
+    # Large enough to amortise the hand-offs, small enough that every worker gets several batches.
+    return max(1, min(PIPELINE_BATCH_ITEMS, items // (4 * workers)))
+
+
+async def _run_stages(
+    items: Sequence[str],
+    stages: Sequence[tuple[str, Callable, int]],
+    budget: _MemoryBudget,
+    stats: PipelineStats,
+    executor: Executor,
+    delivered: queue.SimpleQueue,
+) -> None:
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    queues = [asyncio.Queue(maxsize=2 * workers) for _, _, workers in stages[1:]]
+    finished: dict[int, tuple[list, int]] = {}
+    arrived = asyncio.Event()
+    write_stats = stats.stages[-1]
+    per_batch = _batch_size(len(items), max(workers for _, _, workers in stages))
+    batches = [list(items[start : start + per_batch]) for start in range(0, len(items), per_batch)]
+    admitted: list[int] = []  # how many batches admit() forwarded, once it is done
+
+    async def call(index: int, values: list, size: int) -> tuple[list, int]:
+        stage = stats.stages[index]
+        started = time.perf_counter()
+        if index and any(not isinstance(value, _Failed) and _needs_worker(value) for value in values):
+            values = await loop.run_in_executor(executor, _apply, stages[index][1], values)
+        else:
+            # Resolution (mostly memoised lookups) and finishing already
+            # loaded bodies are cheaper than a hop to the pool.
+            values = _apply(stages[index][1], values)
+        stage.busy_seconds += time.perf_counter() - started
+        stage.items += len(values)
+        if index:
+            # The first stage's result is reserved by admit(); later stages adjust that reservation.
+            resized = sum(_held_bytes(value) for value in values)
+            budget.resize(size, resized)
+            size = resized
+        return values, size
+
+    async def forward(index: int, entry: tuple[int, list, int]) -> None:
+        if index == len(queues):
+            finished[entry[0]] = entry[1:]
+            write_stats.max_queue = max(write_stats.max_queue, len(finished))
+            arrived.set()
+            return
+        started = time.perf_counter()
+        await queues[index].put(entry)
+        stats.stages[index].blocked_seconds += time.perf_counter() - started
+        downstream = stats.stages[index + 1]
+        downstream.max_queue = max(downstream.max_queue, queues[index].qsize())
+
+    async def close(index: int) -> None:
+        if index < len(queues):
+            for _ in range(stages[index + 1][2]):
+                await queues[index].put(None)
+
+    async def admit() -> None:
+        # Entries are reserved one at a time. A batch is cut short at an entry
+        # that does not fit, and sent on before waiting, since its own
+        # reservation may be what the wait is for.
+        position = 0
+        for batch in batches:
+            values, _ = await call(0, batch, 0)
+            admitting: list = []
+            admitting_size = 0
+            for value in values:
+                size = _held_bytes(value)
+                if admitting and not budget.fits(size):
+                    await forward(0, (position, admitting, admitting_size))
+                    position += 1
+                    admitting, admitting_size = [], 0
+                started = time.perf_counter()
+                await budget.acquire(size)
+                stats.stages[0].blocked_seconds += time.perf_counter() - started
+                admitting.append(value)
+                admitting_size += size
+            if admitting:
+                await forward(0, (position, admitting, admitting_size))
+                position += 1
+        admitted.append(position)
+        arrived.set()
+        await close(0)
+
+    async def work(index: int) -> None:
+        stage = stats.stages[index]
+        while True:
+            started = time.perf_counter()
+            entry = await queues[index - 1].get()
+            stage.starved_seconds += time.perf_counter() - started
+            if entry is None:
+                return
+            position, values, size = entry
+            values, size = await call(index, values, size)
+            await forward(index, (position, values, size))
+
+    async def run_stage(index: int) -> None:
+        await asyncio.gather(*(work(index) for _ in range(stages[index][2])))
+        await close(index)
+
+    async def deliver() -> None:
+        position = 0
+        while not admitted or position < admitted[0]:
+            if position in finished:
+                delivered.put(finished.pop(position))
+                position += 1
+            else:
+                arrived.clear()
+                await arrived.wait()
+
+    await asyncio.gather(admit(), *(run_stage(index) for index in range(1, len(stages))), deliver())
+
+
+def _iter_inline(
+    items: Sequence[str],
+    stages: Sequence[tuple[str, Callable, int]],
+    stats: PipelineStats,
+) -> Iterator:
+    clock = time.perf_counter
+    funcs = [func for _, func, _ in stages]
+    busy = [0.0] * (len(stages) + 1)
+    try:
+        for item in items:
+            value = item
+            started = clock()
+            for index, func in enumerate(funcs):
+                value = func(value)
+                finished = clock()
+                busy[index] += finished - started
+                started = finished
+            stats.peak_bytes = max(stats.peak_bytes, _held_bytes(value))
+            yield value
+            busy[-1] += clock() - started
+            for stage in stats.stages:
+                stage.items += 1
+    finally:
+        for stage, seconds in zip(stats.stages, busy):
+            stage.busy_seconds += seconds
+
+
+def iter_staged(
+    items: Sequence[str],
+    stages: Sequence[tuple[str, Callable, int]],
+    memory_cap: int = PIPELINE_MEMORY_CAP,
+    stats: PipelineStats | None = None,
+) -> Iterator:
+    """Run items through (name, func, workers) stages, yielding the results in input order.
+
+    The stages run on an asyncio loop in a helper thread and hand each func to a
+    thread pool, connected by bounded queues, so one batch of entries can be
+    read while another is filtered. Items travel in batches of up to
+    PIPELINE_BATCH_ITEMS, since every hand-off between threads costs about as
+    much as a cached entry's whole trip. The first stage runs one batch at a
+    time and admits its entries in order against memory_cap: each entry
+    reserves the bytes it holds (see _held_bytes) until the caller has consumed
+    its batch, and a batch is cut short at an entry that would take the
+    reservations over the cap, which waits until enough is released. Only an
+    entry larger than the cap on its own, admitted once nothing else is held,
+    can go over it. Later stages adjust an entry's reservation to what it then
+    holds; generated sections such as listings and structure trees reserve
+    nothing until they exist, and may add their size on top.
+    The caller's own work between results is recorded as a final "write"
+    stage. An exception raised by a stage is re-raised here when its item
+    comes up.
+
+    With one worker per stage there is nothing to overlap, so each item runs
+    through the stages inline instead: handing every item between threads
+    costs more than a small build's whole read and filter time.
+    """
+    stats = stats if stats is not None else PipelineStats()
+    stats.memory_cap = memory_cap
+    stats.stages = [StageStats(name, workers) for name, _, workers in stages] + [StageStats("write")]
+    if all(workers == 1 for _, _, workers in stages):
+        return _iter_inline(items, stages, stats)
+    return _iter_threaded(items, stages, memory_cap, stats)
+
+
+def _iter_threaded(
+    items: Sequence[str],
+    stages: Sequence[tuple[str, Callable, int]],
+    memory_cap: int,
+    stats: PipelineStats,
+) -> Iterator:
+    import asyncio
+    import queue
+    from concurrent.futures import ThreadPoolExecutor
+
+    write_stats = stats.stages[-1]
+    loop = asyncio.new_event_loop()
+    budget = _MemoryBudget(memory_cap, stats)
+    delivered: queue.SimpleQueue = queue.SimpleQueue()
+    executor = ThreadPoolExecutor(max_workers=sum(workers for _, _, workers in stages[1:]) or 1)
+    pipeline = loop.create_task(_run_stages(items, stages, budget, stats, executor, delivered))
+
+    def run() -> None:
+        try:
+            loop.run_until_complete(pipeline)
+        except asyncio.CancelledError:
+            pass
+        except BaseException as error:
+            delivered.put(([_Failed(error)], 0))
+
+    runner = threading.Thread(target=run, daemon=True)
+    runner.start()
+    try:
+        remaining = len(items)
+        while remaining:
+            started = time.perf_counter()
+            values, size = delivered.get()
+            write_stats.starved_seconds += time.perf_counter() - started
+            for value in values:
+                if isinstance(value, _Failed):
+                    raise value.error
+                started = time.perf_counter()
+                yield value
+                write_stats.busy_seconds += time.perf_counter() - started
+                write_stats.items += 1
+            remaining -= len(values)
+            loop.call_soon_threadsafe(budget.release, size)
+    finally:
+        loop.call_soon_threadsafe(pipeline.cancel)
+        runner.join()
+        executor.shutdown(wait=True, cancel_futures=True)
+        loop.close()
+
+
+def _filter_with_stats(text: str) -> tuple[str, FilterStats]:
+    stats = FilterStats()
+    return filter_comment_lines(text, stats), stats
+
+
+def _pooled_filter(pool: Executor) -> Callable[[str, FilterStats | None], str]:
+    def filter_text(text: str, stats: FilterStats | None = None) -> str:
+        content, counts = pool.submit(_filter_with_stats, text).result()
+        if stats is not None:
+            stats.__dict__.update(counts.__dict__)
+        return content
+
+    return filter_text
+
+
+class SharedSectionLoader:
+    """Loads each manifest entry at most once, however many targets include it.
+
+    Safe to call from several threads: the first caller for an entry loads it
+    and any concurrent callers wait for that result instead of loading again.
+    """
+
+    def __init__(self, load: Callable[[str], LoadedSection]) -> None:
+        import concurrent.futures
+
+        self._future = concurrent.futures.Future
+        self._load = load
+        self._lock = threading.Lock()
+        self._futures: dict[str, Future[LoadedSection]] = {}
+        self.requests = 0
+
+    def __call__(self, rel_path: str) -> LoadedSection:
+        with self._lock:
+            self.requests += 1
+            future = self._futures.get(rel_path)
+            owner = future is None
+            if owner:
+                future = self._futures[rel_path] = self._future()
+        if owner:
+            try:
+                future.set_result(self._load(rel_path))
+            except BaseException as error:
+                future.set_exception(error)
+        return future.result()
+
+    @property
+    def loads(self) -> int:
+        return len(self._futures)
+
+
+def _git_toplevel(directory: str, toplevels: dict[str, str | None]) -> str | None:
+    """Nearest enclosing work tree of directory (a .git file or folder), memoised."""
+    missed: list[str] = []
+    current = directory
+    while current not in toplevels:
+        if os.path.exists(os.path.join(current, ".git")):
+            toplevels[current] = current
+            break
+        missed.append(current)
+        parent = os.path.dirname(current)
+        if parent == current:
+            toplevels[current] = None
+            break
+        current = parent
+    for path in missed:
+        toplevels[path] = toplevels[current]
+    return toplevels[current]
+
+
+def _git(toplevel: str, *args: str) -> str:
+    import subprocess
+
+    result = subprocess.run(
+        ["git", "-c", "core.quotePath=false", "-C", toplevel, *args],
+        capture_output=True, text=True, encoding="utf-8", errors="surrogateescape",
+    )
+    if result.returncode != 0:
+        raise ValueError(f"git {' '.join(args[:2])} failed in {toplevel}: {result.stderr.strip()}")
+    return result.stdout
+
+
+def _split_git_diff(toplevel: str, patch: str) -> dict[str, str]:
+    """Split `git diff` output into per-file patches keyed by absolute path."""
+    diffs: dict[str, str] = {}
+    for chunk in re.split(r"^(?=diff --git )", patch, flags=re.MULTILINE):
+        header, _, _ = chunk.partition("\n")
+        if not header.startswith("diff --git a/"):
+            continue
+        # "a/<path> b/<path>" with the same path on both sides; renames are not detected.
+        paths = header[len("diff --git a/"):]
+        diffs[os.path.join(toplevel, paths[: (len(paths) - 3) // 2])] = chunk
+    return diffs
+
+
+def changed_since(
+    repo_root: Path,
+    source_files: Sequence[str],
+    rev: str,
+    resolver: SourceResolver | None = None,
+    with_diffs: bool = False,
+) -> tuple[list[str], dict[str, str]]:
+    """Return the manifest entries changed since rev, and their patches if with_diffs.
+
+    Entries are grouped by the git work tree their resolved path lives in, so
+    libraries symlinked in from other repositories are compared in their own
+    history. Each work tree costs one `git diff --name-only` and one
+    `git ls-files --others` (untracked files count as changed), plus one
+    `git diff` for the patches. Directory and structure entries are kept when
+    anything beneath them changed. Patches are keyed by manifest entry; new and
+    binary files get none and are loaded whole.
+    """
+    toplevels: dict[str, str | None] = {}
+    resolved: list[tuple[str, str, str | None]] = []
+    for rel_path in source_files:
+        lookup_path = entry_lookup_path(rel_path)
+        path = resolver.resolve(lookup_path) if resolver is not None else resolve_source_path(repo_root, lookup_path)
+        real_path = os.path.realpath(path)
+        directory = real_path if os.path.isdir(real_path) else os.path.dirname(real_path)
+        resolved.append((rel_path, real_path, _git_toplevel(directory, toplevels)))
+
+    changed: set[str] = set()
+    patches: dict[str, str] = {}
+    for toplevel in {toplevel for _, _, toplevel in resolved if toplevel is not None}:
+        names = _git(toplevel, "diff", "--name-only", "-z", rev, "--")
+        names += _git(toplevel, "ls-files", "--others", "--exclude-standard", "-z")
+        tree_changes = {os.path.join(toplevel, name) for name in names.split("\0") if name}
+        changed |= tree_changes
+        wanted = [os.path.relpath(real_path, toplevel) for _, real_path, top in resolved
+                  if top == toplevel and real_path in tree_changes]
+        if with_diffs and wanted:
+            patches.update(_split_git_diff(toplevel, _git(toplevel, "diff", rev, "--", *wanted)))
+
+    selected: list[str] = []
+    diffs: dict[str, str] = {}
+    changed_dirs = {os.path.dirname(path) for path in changed}
+    for rel_path, real_path, _ in resolved:
+        if real_path in changed:
+            selected.append(rel_path)
+            patch = patches.get(real_path, "")
+            if "\n@@ " in patch:
+                diffs[rel_path] = patch
+        elif any(directory == real_path or directory.startswith(real_path + os.sep) for directory in changed_dirs):
+            selected.append(rel_path)
+    return selected, diffs
+
+
+def diff_section(rel_path: str, rev: str, patch: str) -> LoadedSection:
+    started = time.perf_counter()
+    section = f"==== {rel_path} (changes since {rev}) ====\n\n{patch.rstrip()}\n"
+    stats = LoadStats(load_seconds=time.perf_counter() - started, filter_stats=FilterStats.unfiltered(patch))
+    return LoadedSection(rel_path, section, 0.0, stats, content_sha256(patch))
+
+
+def duplicate_reference(rel_path: str, first_path: str, digest: str) -> str:
+    """Section emitted in place of one whose body matches an earlier section."""
+    return f"==== {rel_path} ====\n\n[Identical to {first_path} above; sha256 {digest[:16]}]\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: roughly four characters per token for source code."""
+    return (len(text) + 3) // 4
+
+
+_WORD_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+def estimate_tokens_by_words(text: str) -> int:
+    """Count identifiers, numbers and punctuation marks; slower but closer to BPE on code."""
+    return sum(1 for _ in _WORD_TOKEN_PATTERN.finditer(text))
+
+
+def _tiktoken_estimator() -> Callable[[str], int]:
+    try:
+        import tiktoken
+    except ImportError as error:
+        raise ValueError("the tiktoken tokenizer needs the optional 'tiktoken' package") from error
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+TOKEN_ESTIMATORS: dict[str, Callable[[], Callable[[str], int]]] = {
+    "chars": lambda: estimate_tokens,
+    "words": lambda: estimate_tokens_by_words,
+    "tiktoken": _tiktoken_estimator,
+}
+
+
+def get_token_estimator(name: str) -> Callable[[str], int]:
+    try:
+        factory = TOKEN_ESTIMATORS[name]
+    except KeyError:
+        raise ValueError(f"unknown tokenizer '{name}'; choose from {', '.join(TOKEN_ESTIMATORS)}") from None
+    return factory()
+
+
+def truncate_section(section: str, max_tokens: int, estimate: Callable[[str], int]) -> str:
+    """Cut a section at a line boundary so that it fits in max_tokens, keeping its header."""
+    total = estimate(section)
+    header, _, body = section.partition("\n\n")
+    marker = f"\n[... truncated to fit the token budget; about {total:,} tokens in full]\n"
+    limit = len(body) * max(max_tokens - estimate(header) - estimate(marker), 0) // max(total, 1)
+    while True:
+        kept = body[:limit]
+        if limit < len(body) and "\n" in kept:
+            kept = kept[: kept.rfind("\n") + 1]
+        candidate = f"{header}\n\n{kept.rstrip()}{marker}"
+        if estimate(candidate) <= max_tokens or not kept:
+            return candidate
+        limit = len(kept) * 9 // 10
+
+
+def plan_token_budget(
+    token_counts: Sequence[int], priorities: Sequence[int], max_tokens: int
+) -> list[int]:
+    """Return how many tokens each section may keep under max_tokens.
+
+    Sections are granted their full count in priority order (higher first, then
+    manifest order); the first one that does not fit gets whatever is left and
+    everything after it gets nothing.
+    """
+    allowances = [0] * len(token_counts)
+    remaining = max_tokens
+    order = sorted(range(len(token_counts)), key=lambda index: (-priorities[index], index))
+    for index in order:
+        allowances[index] = min(token_counts[index], remaining)
+        remaining -= allowances[index]
+    return allowances
+
 
 def concatenate_sources_for(
     source_files: list[str],
     output_filename: str,
-    secondary_output_path: Path,
-) -> tuple[Path, int, int, int, list[tuple[str, int, int]]]:
-    """Generic concatenation routine used by both primary and temp runs."""
+    secondary_output_path: Path | Iterable[Path] | None,
+    cache: ContentCache | None = None,
+    *,
+    jobs: int = 1,
+    use_processes: bool = False,
+    resolver: SourceResolver | None = None,
+    repo_root: Path | None = None,
+    max_tokens: int | None = None,
+    estimate: Callable[[str], int] = estimate_tokens,
+    priorities: Mapping[str, int] | None = None,
+    loader: Callable[[str], LoadedSection] | None = None,
+    structures: StructureCache | None = None,
+    symbols: SymbolIndex | None = None,
+    dedupe: bool = True,
+    archive_path: Path | None = None,
+    since: str | None = None,
+    since_diffs: bool = False,
+    fsync: bool = False,
+    memory_cap: int = PIPELINE_MEMORY_CAP,
+    tables: TableStore | None = None,
+) -> BundleResult:
+    """Generic concatenation routine used by both primary and temp runs.
+
+    Entries flow through the resolve, read, filter and write stages of
+    iter_staged; jobs workers each read and filter, use_processes moves
+    filter_comment_lines onto a process pool, and memory_cap bounds the bytes
+    held between admission and write. Sections are always written in manifest
+    order, and the stage statistics come back in the result. repo_root
+    defaults to the parent of this directory.
+
+    max_tokens caps the bundle at an estimated token count. Sections are kept
+    in manifest order until the budget runs out, or, with priorities (higher
+    first, default 0), in priority order, which means loading every section
+    before writing. The section that crosses the budget is truncated if at
+    least BUDGET_MIN_TRUNCATED_TOKENS remain, and later ones are dropped; both
+    show up as cut_tokens in the per-file stats.
+
+    With dedupe, a section whose body is identical to one already written (same
+    content hash, e.g. a copied asset or the same file reached through another
+    worktree) is replaced by a one-line back-reference to the first path.
+
+    archive_path additionally writes the same sections as an indexed archive
+    (see ArchiveWriter) that BundleArchive can read one section at a time.
+
+    since limits the bundle to entries changed since that git revision (see
+    changed_since); with since_diffs, changed text files are written as their
+    unified diff instead of in full. Such a bundle, its copies and its archive
+    go to their own names (see since_path_for), so the full bundle and its
+    history are left alone.
+
+    Every build also writes an integrity record next to the output (see
+    write_integrity), which verify_bundle checks against the tree.
+
+    tables collapses large array and dictionary literals into summaries and
+    keeps the originals there (see collapse_tables); bytes saved are per file.
+
+    secondary_output_path may be one path or several; outputs are published as
+    described in BundleWriter, and their statuses come back in the result.
+    Everything after cache is keyword-only.
+
+    loader replaces the read and filter stages with a single load stage (cache
+    and use_processes are then unused), e.g. with a SharedSectionLoader when
+    several targets are built together.
+    """
     docs_dir = Path(__file__).resolve().parent
-    repo_root = docs_dir.parent
+    if repo_root is None:
+        repo_root = docs_dir.parent
     output_path = docs_dir / output_filename
+    if secondary_output_path is None:
+        secondary_paths: list[Path] = []
+    elif isinstance(secondary_output_path, Path):
+        secondary_paths = [secondary_output_path]
+    else:
+        secondary_paths = list(secondary_output_path)
+    if since is not None:
+        output_path = since_path_for(output_path)
+        secondary_paths = [since_path_for(path) for path in secondary_paths]
+        archive_path = since_path_for(archive_path) if archive_path is not None else None
+    if cache is not None and loader is None:
+        cache.reset_stats()
 
-    output_parts: list[str] = []
-    per_file_chunks: list[tuple[str, str]] = []
-
-    for index, rel_path in enumerate(source_files):
-        source_path = resolve_source_path(repo_root, rel_path)
-        contents = load_source_content(source_path)
-        header = f"==== {rel_path} ===="
-        section = f"{header}\n\n{contents.rstrip()}\n"
+    from concurrent.futures import ProcessPoolExecutor
 
-        if index > 0:
-            output_parts.append("\n")
-            chunk_text = "\n" + section
-        else:
-            chunk_text = section
-
-        output_parts.append(section)
-        per_file_chunks.append((rel_path, chunk_text))
-
-    output = "".join(output_parts)
-    output_path.write_text(output, encoding="utf-8")
-    total_chars = len(output)
-    total_bytes = len(output.encode("utf-8"))
-    comment_chars = sum_comment_characters(output)
-    per_file_stats = [
-        (rel_path, len(chunk), len(chunk.encode("utf-8")))
-        for rel_path, chunk in per_file_chunks
+    process_pool = None
+    stages: list[tuple[str, Callable, int]] = [
+        ("resolve", lambda rel_path: resolve_entry(repo_root, rel_path, resolver), 1)
     ]
-    per_file_stats.sort(key=lambda item: item[1])
+    if loader is None:
+        process_pool = ProcessPoolExecutor(max_workers=jobs) if use_processes and jobs > 1 else None
+        filter_text = _pooled_filter(process_pool) if process_pool else filter_comment_lines
+        stages.append(("read", lambda entry: read_entry(entry, cache, structures, symbols), jobs))
+        stages.append(("filter", lambda read: finish_entry(read, filter_text, tables), jobs))
+    else:
+        stages.append(("load", lambda entry: loader(entry.rel_path), jobs))
+
+    if since is not None:
+        source_files, diffs = changed_since(repo_root, source_files, since, resolver, since_diffs)
+        if diffs:
+            name, load_whole, workers = stages[1]
+
+            def load(entry: ResolvedEntry) -> ReadEntry | LoadedSection:
+                patch = diffs.get(entry.rel_path)
+                if patch is None:
+                    return load_whole(entry)
+                source_stat = (entry.mtime_ns, entry.size) if entry.mtime_ns is not None else None
+                return diff_section(entry.rel_path, since, patch)._replace(path=entry.path, source_stat=source_stat)
+
+            stages[1] = (name, load, workers)
+
+    per_file_stats: list[FileStats] = []
+    records: list[dict] = []
+    pipeline = PipelineStats()
+    staged = iter_staged(source_files, stages, memory_cap, pipeline)
 
     try:
-        secondary_output_path.parent.mkdir(parents=True, exist_ok=True)
-        secondary_output_path.write_text(output, encoding="utf-8")
-    except OSError:
-        pass
-    return output_path, total_chars, comment_chars, total_bytes, per_file_stats
+        sections: Iterable[LoadedSection] = staged
+        allowances: list[int] | None = None
+        if max_tokens is not None and priorities:
+            sections = list(sections)
+            allowances = plan_token_budget(
+                [estimate(loaded.section) for loaded in sections],
+                [priorities.get(loaded.rel_path, 0) for loaded in sections],
+                max_tokens,
+            )
+        remaining = max_tokens
+        written: dict[str, str] = {}
+
+        archive_writer = ArchiveWriter(archive_path) if archive_path is not None else nullcontext()
+        bundle_writer = BundleWriter(output_path, secondary_paths, fsync)
+        with bundle_writer as writer, archive_writer as archive:
+            for index, loaded in enumerate(sections):
+                section = loaded.section
+                duplicate_of = written.get(loaded.digest) if dedupe else None
+                saved_bytes = 0
+                if duplicate_of is not None:
+                    reference = duplicate_reference(loaded.rel_path, duplicate_of, loaded.digest)
+                    saved_bytes = len(section.encode("utf-8")) - len(reference.encode("utf-8"))
+                    if saved_bytes > 0:
+                        section = reference
+                    else:
+                        duplicate_of, saved_bytes = None, 0
+                tokens = estimate(section)
+                kept_tokens = tokens
+                if max_tokens is not None:
+                    allowed = allowances[index] if allowances is not None else min(tokens, remaining)
+                    if allowed < tokens:
+                        if allowed >= BUDGET_MIN_TRUNCATED_TOKENS:
+                            section = truncate_section(section, allowed, estimate)
+                            kept_tokens = estimate(section)
+                        else:
+                            section, kept_tokens = "", 0
+                    remaining = max(remaining - kept_tokens, 0)
+
+                counts = loaded.stats.filter_stats
+                chunk_chars = chunk_bytes = chunk_comment_chars = 0
+                collapsed = duplicate_of is None and bool(section)
+                offset = writer.total_bytes
+                if section:
+                    chunk_text = "\n" + section if writer.total_chars else section
+                    chunk_chars, chunk_bytes = writer.write(chunk_text)
+                    if duplicate_of is None:
+                        # Truncated sections keep a proportional share of their comments.
+                        chunk_comment_chars = counts.kept_comment_chars * len(section) // len(loaded.section)
+                    if archive is not None:
+                        archive.add(loaded.rel_path, section)
+                    if duplicate_of is None and kept_tokens == tokens:
+                        written.setdefault(loaded.digest, loaded.rel_path)
+                records.append(integrity_record(loaded, offset, chunk_bytes, writer.chunk_sha256s[-1] if section else None))
+                per_file_stats.append(
+                    FileStats(
+                        loaded.rel_path,
+                        chunk_chars,
+                        chunk_bytes,
+                        loaded.resolve_seconds,
+                        loaded.stats.load_seconds,
+                        loaded.stats.filter_seconds,
+                        loaded.stats.cache_hit,
+                        kept_tokens,
+                        tokens - kept_tokens,
+                        duplicate_of,
+                        saved_bytes,
+                        chunk_comment_chars,
+                        loaded.stats.filtered_chars,
+                        loaded.root,
+                        counts.source_chars,
+                        counts.code_chars,
+                        counts.stripped_comment_chars,
+                        counts.source_lines,
+                        counts.lines,
+                        loaded.stats.tables if collapsed else 0,
+                        loaded.stats.table_bytes_saved if collapsed else 0,
+                    )
+                )
+        write_integrity(output_path, writer, records, since)
+    finally:
+        staged.close()
+        if process_pool is not None:
+            process_pool.shutdown()
+
+    per_file_stats.sort(key=lambda item: item[1])
+    total_chars = writer.total_chars
+    total_bytes = writer.total_bytes
+    comment_chars = sum(stat.comment_chars for stat in per_file_stats)
+    return BundleResult(output_path, total_chars, comment_chars, total_bytes, per_file_stats, writer.destinations, pipeline)
 
 
 def concatenate_sources(
     source_files: list[str],
     output_filename: str,
     secondary_output_path: Path,
-) -> tuple[Path, int, int, int, list[tuple[str, int, int]]]:
+    cache: ContentCache | None = None,
+    jobs: int = 1,
+    use_processes: bool = False,
+    resolver: SourceResolver | None = None,
+) -> BundleResult:
     """Convenience wrapper around concatenate_sources_for for the main run."""
-    return concatenate_sources_for(source_files, output_filename, secondary_output_path)
+    return concatenate_sources_for(
+        source_files, output_filename, secondary_output_path, cache, jobs=jobs, use_processes=use_processes, resolver=resolver
+    )
+
+def archive_path_for(output_path: Path) -> Path:
+    return output_path.with_suffix(ARCHIVE_SUFFIX)
+
+
+def since_path_for(path: Path) -> Path:
+    """Where a --since build writes instead of path: bundle.txt becomes bundle.since.txt."""
+    return path.with_name(f"{path.stem}{SINCE_INFIX}{path.suffix}")
+
+
+def integrity_path_for(output_path: Path) -> Path:
+    return output_path.with_suffix(INTEGRITY_SUFFIX)
+
+
+def integrity_record(loaded: LoadedSection, offset: int, length: int, sha256: str | None) -> dict:
+    """What the integrity record keeps about one section: where it sits and what it came from."""
+    mtime_ns, size = loaded.source_stat or (None, None)
+    return {
+        "path": loaded.rel_path,
+        "resolved": str(loaded.path) if loaded.path is not None else None,
+        "offset": offset,
+        "length": length,
+        "sha256": sha256,
+        "content_sha256": loaded.digest,
+        "source_size": size,
+        "source_mtime_ns": mtime_ns,
+    }
+
+
+def write_integrity(output_path: Path, writer: BundleWriter, records: list[dict], since: str | None = None) -> None:
+    """Write the integrity record for a closed writer's output next to it.
+
+    It lists every entry in bundle order with the byte range and sha256 of its
+    chunk in the output (chunks include the separating newline, so the ranges
+    tile the file), the hash of its section body and the size and mtime its
+    source had before it was read, plus the copies that were published.
+    """
+    copies = [str(destination.path) for destination in writer.destinations[1:] if destination.status != "failed"]
+    payload = {
+        "version": INTEGRITY_VERSION,
+        "built": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "output": str(output_path),
+        "bytes": writer.total_bytes,
+        "copies": copies,
+        "since": since,
+        "sections": records,
+    }
+    path = integrity_path_for(output_path)
+    tmp_path = _temp_sibling(path)
+    # Compact, so json uses its C encoder; indenting a few hundred records costs milliseconds.
+    tmp_path.write_text(json.dumps(payload, separators=(",", ":")), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+VERIFY_BATCH_BYTES = 4 * HASH_CHUNK_SIZE
+
+
+class CopyCheck(NamedTuple):
+    path: Path
+    status: str  # "intact", "stale" or "missing"
+    detail: str = ""
+
+
+class VerifyResult(NamedTuple):
+    output: Path
+    sections: int
+    changed: list[str]  # entries whose section would come out differently now
+    touched: list[str]  # entries whose source moved (mtime or size) but yields the same section
+    added: list[str]
+    removed: list[str]
+    reordered: bool
+    copies: list[CopyCheck]
+    seconds: float
+
+    @property
+    def fresh(self) -> bool:
+        return (
+            not self.changed and not self.added and not self.removed and not self.reordered
+            and all(copy.status == "intact" for copy in self.copies)
+        )
+
+
+def _check_chunks(path: Path, batch: Sequence[dict]) -> str | None:
+    """Hash each section's byte range in path; return the first entry that does not match."""
+    with path.open("rb") as handle:
+        fd = handle.fileno()
+        for record in batch:
+            data = os.pread(fd, record["length"], record["offset"])
+            if hashlib.sha256(data).hexdigest() != record["sha256"]:
+                return record["path"]
+    return None
+
+
+def verify_bundle(
+    output_path: Path,
+    repo_root: Path,
+    entries: Sequence[str] | None = None,
+    resolver: SourceResolver | None = None,
+    cache: ContentCache | None = None,
+    structures: StructureCache | None = None,
+    symbols: SymbolIndex | None = None,
+    jobs: int | None = None,
+) -> VerifyResult:
+    """Check a built bundle and its copies against its integrity record and the tree.
+
+    A source whose size and mtime match the record counts as unchanged
+    without being read; any other entry (including generated ones such as
+    structure trees) is loaded and filtered again, and is stale only if its
+    section body hashes differently. The output and every recorded copy are
+    hashed section by section in batches of about VERIFY_BATCH_BYTES, all on
+    one pool of jobs threads. With entries, a change to the entry list (as
+    expanded now) also makes the bundle stale, unless it was built with
+    --since. Raises ValueError if there is no usable integrity record.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    started = time.perf_counter()
+    path = integrity_path_for(output_path)
+    try:
+        record = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        raise ValueError(f"no integrity record for {output_path.name} (expected {path.name}); build it first") from None
+    if not isinstance(record, dict) or record.get("version") != INTEGRITY_VERSION:
+        raise ValueError(f"{path} is from another version of this script; rebuild to refresh it")
+    sections = record["sections"]
+    resolver = resolver or SourceResolver(repo_root)
+
+    def check_source(section: dict) -> str:
+        rel_path = section["path"]
+        if section["source_mtime_ns"] is not None:
+            resolved = resolver.resolve(entry_lookup_path(rel_path))
+            if str(resolved) != section["resolved"]:
+                return "changed"
+            try:
+                stat = os.stat(resolved)
+            except OSError:
+                return "changed"
+            if stat.st_mtime_ns == section["source_mtime_ns"] and stat.st_size == section["source_size"]:
+                return "fresh"
+        try:
+            loaded = load_section(repo_root, rel_path, cache, filter_comment_lines, resolver, structures, symbols)
+        except OSError:
+            return "changed"
+        if loaded.digest != section["content_sha256"]:
+            return "changed"
+        return "touched" if section["source_mtime_ns"] is not None else "fresh"
+
+    chunks = [section for section in sections if section["length"]]
+    batches: list[list[dict]] = []
+    size = VERIFY_BATCH_BYTES
+    for section in chunks:
+        if size >= VERIFY_BATCH_BYTES:
+            batches.append([])
+            size = 0
+        batches[-1].append(section)
+        size += section["length"]
+
+    copies: list[CopyCheck] = []
+    pending = []
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        states = pool.map(check_source, sections)
+        for copy in [output_path, *(Path(copy) for copy in record["copies"])]:
+            try:
+                copy_size = copy.stat().st_size
+            except OSError:
+                copies.append(CopyCheck(copy, "missing"))
+                continue
+            if copy_size != record["bytes"]:
+                copies.append(CopyCheck(copy, "stale", f"{copy_size:,} bytes, {record['bytes']:,} recorded"))
+                continue
+            copies.append(CopyCheck(copy, "intact"))
+            pending.append((len(copies) - 1, [pool.submit(_check_chunks, copy, batch) for batch in batches]))
+        states = list(states)
+        for index, futures in pending:
+            mismatch = next((result for result in (future.result() for future in futures) if result), None)
+            if mismatch is not None:
+                copies[index] = CopyCheck(copies[index].path, "stale", f"differs in {mismatch}")
+
+    recorded = [section["path"] for section in sections]
+    added = removed = []
+    reordered = False
+    # A --since bundle holds only the entries that had changed, so its list is not compared.
+    if entries is not None and record["since"] is None and list(entries) != recorded:
+        current, previous = Counter(entries), Counter(recorded)
+        added = list((current - previous).elements())  # counted, so a repeated entry shows up too
+        removed = list((previous - current).elements())
+        reordered = not added and not removed
+    return VerifyResult(
+        output_path,
+        len(sections),
+        [section["path"] for section, state in zip(sections, states) if state == "changed"],
+        [section["path"] for section, state in zip(sections, states) if state == "touched"],
+        added,
+        removed,
+        reordered,
+        copies,
+        time.perf_counter() - started,
+    )
+
+
+def verify_lines(result: VerifyResult) -> list[str]:
+    """Describe a VerifyResult: one line when fresh, the reasons otherwise."""
+    name = result.output.name
+    touched = f"; {_plural(len(result.touched), 'source')} touched but unchanged" if result.touched else ""
+    timing = f"in {result.seconds * 1000:,.0f} ms"
+    if result.fresh:
+        count = len(result.copies) - 1
+        copies = f"output and {count} {'copy' if count == 1 else 'copies'}" if count else "output"
+        return [f"{name}: up to date ({_plural(result.sections, 'section')}{touched}; {copies} intact) {timing}"]
+    lines = [f"{name}: stale {timing}"]
+    lines.extend(f"    changed  {rel_path}" for rel_path in result.changed)
+    lines.extend(f"    added    {rel_path}" for rel_path in result.added)
+    lines.extend(f"    removed  {rel_path}" for rel_path in result.removed)
+    if result.reordered:
+        lines.append("    entries were reordered")
+    for copy in result.copies:
+        if copy.status != "intact":
+            detail = f" ({copy.detail})" if copy.detail else ""
+            lines.append(f"    {copy.status:<8} {copy.path}{detail}")
+    return lines
+
+
+def bundle_inputs(
+    results: Iterable[BundleResult],
+    resolver: SourceResolver,
+    structures: StructureCache | None = None,
+) -> tuple[set[str], set[str]]:
+    """Return (inputs, outputs): the paths the builds behind results read and wrote.
+
+    Inputs are the resolved entries (with everything below a directory entry)
+    and whatever structure entries and globs looked at through structures;
+    outputs are the destinations and the archive and integrity record next to
+    the bundle, where present.
+    """
+    inputs = set(structures._touched) if structures is not None else set()
+    outputs: set[str] = set()
+    for result in results:
+        outputs.update(str(destination.path) for destination in result.destinations)
+        for sidecar in (archive_path_for(result.path), integrity_path_for(result.path)):
+            if sidecar.exists():
+                outputs.add(str(sidecar))
+        for stat in result.per_file_stats:
+            if stat.rel_path.startswith(STRUCTURE_PREFIX):
+                continue
+            path = str(resolver.resolve(entry_lookup_path(stat.rel_path)))
+            inputs.add(path)
+            if os.path.isdir(path):
+                for current, dirnames, filenames in os.walk(path):
+                    inputs.update(os.path.join(current, name) for name in dirnames + filenames)
+    return inputs, outputs
+
+
+@dataclass
+class BuildTarget:
+    """One named bundle declared in a manifest file."""
+
+    name: str
+    include: list[str]
+    output: Path
+    exclude: list[str] = field(default_factory=list)
+    secondary: list[Path] = field(default_factory=list)
+    max_tokens: int | None = None
+    priorities: dict[str, int] = field(default_factory=dict)
+
+
+_TARGET_KEYS = {"include", "exclude", "output", "secondary", "max_tokens", "priorities"}
+
+
+def load_manifest(path: Path) -> list[BuildTarget]:
+    """Read build targets from a .toml or .json manifest.
+
+    Each entry of the `targets` table is one bundle. `include` lists entries in
+    output order (plain paths as in SOURCE_FILES, or globs such as
+    "AnimLibS/**/*.swift"), `exclude` lists fnmatch patterns removed from the
+    expanded globs, and `output` / `secondary` are the bundle paths, relative
+    to the manifest's directory (`secondary` may also be a list). A top-level
+    `defaults` table supplies values for keys a target leaves out; `exclude`
+    patterns and `priorities` are added to the defaults rather than replacing them.
+    """
+    raw = path.read_bytes()
+    if path.suffix == ".toml":
+        import tomllib
+
+        data = tomllib.loads(raw.decode("utf-8"))
+    else:
+        data = json.loads(raw)
+
+    defaults = data.get("defaults", {})
+    targets: list[BuildTarget] = []
+    for name, spec in data.get("targets", {}).items():
+        merged = {**defaults, **spec}
+        if "exclude" in defaults and "exclude" in spec:
+            merged["exclude"] = [*defaults["exclude"], *(pattern for pattern in spec["exclude"] if pattern not in defaults["exclude"])]
+        if "priorities" in defaults and "priorities" in spec:
+            merged["priorities"] = {**defaults["priorities"], **spec["priorities"]}
+        unknown = set(merged) - _TARGET_KEYS
+        if unknown:
+            raise ValueError(f"{path}: target '{name}' has unknown keys: {', '.join(sorted(unknown))}")
+        if not merged.get("include") or not merged.get("output"):
+            raise ValueError(f"{path}: target '{name}' needs both 'include' and 'output'")
+        secondary = merged.get("secondary") or []
+        if isinstance(secondary, str):
+            secondary = [secondary]
+        targets.append(
+            BuildTarget(
+                name,
+                list(merged["include"]),
+                path.parent / merged["output"],
+                list(merged.get("exclude", [])),
+                [path.parent / destination for destination in secondary],
+                merged.get("max_tokens"),
+                dict(merged.get("priorities", {})),
+            )
+        )
+    return targets
+
+
+def expand_entries(
+    repo_root: Path,
+    include: Iterable[str],
+    exclude: Sequence[str] = (),
+    structures: StructureCache | None = None,
+) -> list[str]:
+    """Expand glob entries against the search roots, keeping plain entries as they are.
+
+    Glob matches are sorted within their entry and an entry already produced
+    earlier is not repeated. exclude patterns apply to the expanded matches only.
+    Directory listings come from structures, so an unchanged tree is not re-listed.
+    """
+    structures = structures or StructureCache(None)
+    expanded: list[str] = []
+    seen: set[str] = set()
+    for entry in include:
+        if entry_lookup_path(entry) != entry or not _GLOB_CHARACTERS.search(entry):
+            matches = [entry]
+        else:
+            found: set[str] = set()
+            for root in _search_roots(repo_root):
+                for rel_path in structures.glob(root, entry):
+                    if not _matches_any(rel_path, rel_path.rpartition("/")[2], exclude):
+                        found.add(rel_path)
+            matches = sorted(found)
+        for rel_path in matches:
+            if rel_path not in seen:
+                seen.add(rel_path)
+                expanded.append(rel_path)
+    return expanded
+
+
+def source_cache_keys(
+    repo_root: Path,
+    entry_lists: Iterable[tuple[Sequence[str], Sequence[str]]],
+    resolver: SourceResolver | None = None,
+    structures: StructureCache | None = None,
+) -> set[str]:
+    """ContentCache keys of the files named by (include, exclude) entry lists.
+
+    structure: entries and entries that no longer resolve are skipped; neither
+    has a cache entry worth keeping.
+    """
+    keys: set[str] = set()
+    for include, exclude in entry_lists:
+        for entry in expand_entries(repo_root, include, exclude, structures):
+            if entry.startswith(STRUCTURE_PREFIX):
+                continue
+            lookup = entry_lookup_path(entry)
+            try:
+                path = resolver.resolve(lookup) if resolver is not None else resolve_source_path(repo_root, lookup)
+            except FileNotFoundError:
+                continue
+            keys.add(str(path.resolve()))
+    return keys
+
+
+def build_targets(
+    targets: Sequence[BuildTarget],
+    repo_root: Path,
+    cache: ContentCache | None = None,
+    *,
+    jobs: int = 1,
+    use_processes: bool = False,
+    resolver: SourceResolver | None = None,
+    estimate: Callable[[str], int] = estimate_tokens,
+    max_tokens: int | None = None,
+    structures: StructureCache | None = None,
+    symbols: SymbolIndex | None = None,
+    dedupe: bool = True,
+    archive: bool = False,
+    since: str | None = None,
+    since_diffs: bool = False,
+    fsync: bool = False,
+    memory_cap: int = PIPELINE_MEMORY_CAP,
+    tables: TableStore | None = None,
+) -> tuple[list[tuple[BuildTarget, BundleResult]], SharedSectionLoader]:
+    """Build several targets concurrently, loading entries they share only once.
+
+    Results come back in target order. max_tokens applies to targets that do
+    not set their own budget; memory_cap applies to each target's pipeline.
+    The options after cache are keyword-only, as for concatenate_sources_for.
+    """
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+    if cache is not None:
+        cache.reset_stats()
+    process_pool = ProcessPoolExecutor(max_workers=jobs) if use_processes and jobs > 1 else None
+    filter_text = _pooled_filter(process_pool) if process_pool else filter_comment_lines
+    loader = SharedSectionLoader(
+        lambda rel_path: load_section(repo_root, rel_path, cache, filter_text, resolver, structures, symbols, tables)
+    )
+
+    def build(target: BuildTarget) -> BundleResult:
+        return concatenate_sources_for(
+            expand_entries(repo_root, target.include, target.exclude, structures),
+            str(target.output.resolve()),
+            target.secondary,
+            jobs=jobs,
+            resolver=resolver,
+            repo_root=repo_root,
+            max_tokens=target.max_tokens if target.max_tokens is not None else max_tokens,
+            estimate=estimate,
+            priorities=target.priorities,
+            loader=loader,
+            dedupe=dedupe,
+            archive_path=archive_path_for(target.output.resolve()) if archive else None,
+            since=since,
+            since_diffs=since_diffs,
+            fsync=fsync,
+            memory_cap=memory_cap,
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as pool:
+            results = list(pool.map(build, targets))
+    finally:
+        if process_pool is not None:
+            process_pool.shutdown()
+    return list(zip(targets, results)), loader
+
+
+def bundle_report(
+    result: BundleResult,
+    wall_seconds: float,
+    cache: ContentCache | None = None,
+    target: str | None = None,
+) -> dict:
+    """Machine-readable summary of one bundle build, as stored in the history file."""
+    files = [
+        {
+            "path": stat.rel_path,
+            "root": stat.root,
+            "chars": stat.chars,
+            "bytes": stat.bytes,
+            "comment_chars": stat.comment_chars,
+            "filtered_chars": stat.filtered_chars,
+            "source_chars": stat.source_chars,
+            "code_chars": stat.code_chars,
+            "stripped_comment_chars": stat.stripped_comment_chars,
+            "source_lines": stat.source_lines,
+            "lines": stat.lines,
+            "tables": stat.tables,
+            "table_bytes_saved": stat.table_bytes_saved,
+            "tokens": stat.tokens,
+            "cut_tokens": stat.cut_tokens,
+            "duplicate_of": stat.duplicate_of,
+            "cache_hit": stat.cache_hit,
+            "resolve_ms": round(stat.resolve_seconds * 1000, 3),
+            "load_ms": round(stat.load_seconds * 1000, 3),
+            "filter_ms": round(stat.filter_seconds * 1000, 3),
+        }
+        for stat in result.per_file_stats
+    ]
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "target": target,
+        "output": str(result.path),
+        "totals": {
+            "files": len(files),
+            "chars": result.total_chars,
+            "bytes": result.total_bytes,
+            "comment_chars": result.comment_chars,
+            "filtered_chars": sum(item["filtered_chars"] for item in files),
+            "source_chars": sum(item["source_chars"] for item in files),
+            "code_chars": sum(item["code_chars"] for item in files),
+            "stripped_comment_chars": sum(item["stripped_comment_chars"] for item in files),
+            "source_lines": sum(item["source_lines"] for item in files),
+            "lines": sum(item["lines"] for item in files),
+            "tables": sum(item["tables"] for item in files),
+            "table_bytes_saved": sum(item["table_bytes_saved"] for item in files),
+            "tokens": sum(item["tokens"] for item in files),
+            "cache_hits": cache.hits if cache is not None else None,
+            "cache_misses": cache.misses if cache is not None else None,
+            "resolve_ms": round(sum(item["resolve_ms"] for item in files), 3),
+            "load_ms": round(sum(item["load_ms"] for item in files), 3),
+            "filter_ms": round(sum(item["filter_ms"] for item in files), 3),
+            "wall_ms": round(wall_seconds * 1000, 3),
+        },
+        "destinations": [
+            {"path": str(destination.path), "status": destination.status, "detail": destination.detail}
+            for destination in result.destinations
+        ],
+        "pipeline": _pipeline_report(result.pipeline),
+        "files": files,
+    }
+
+
+def _pipeline_report(pipeline: PipelineStats | None) -> dict | None:
+    if pipeline is None:
+        return None
+    return {
+        "memory_cap": pipeline.memory_cap,
+        "peak_bytes": pipeline.peak_bytes,
+        "stages": [
+            {
+                "name": stage.name,
+                "workers": stage.workers,
+                "items": stage.items,
+                "busy_ms": round(stage.busy_seconds * 1000, 3),
+                "starved_ms": round(stage.starved_seconds * 1000, 3),
+                "blocked_ms": round(stage.blocked_seconds * 1000, 3),
+                "max_queue": stage.max_queue,
+            }
+            for stage in pipeline.stages
+        ],
+    }
+
+
+def report_ndjson_lines(report: dict) -> Iterator[str]:
+    """One JSON object per file, then one for the run totals."""
+    for item in report["files"]:
+        yield json.dumps({"type": "file", "output": report["output"], **item})
+    run = {key: value for key, value in report.items() if key != "files"}
+    yield json.dumps({"type": "run", **run})
+
+
+def append_history(
+    reports: Iterable[dict],
+    path: Path = HISTORY_PATH,
+    max_runs: int = HISTORY_MAX_RUNS,
+    max_bytes: int = HISTORY_MAX_BYTES,
+) -> None:
+    """Append reports to the history file, trimming it once it outgrows max_bytes.
+
+    A trim keeps the last max_runs reports of each output, fewer if those
+    would still fill more than half of max_bytes, so the file is only read
+    back and rewritten once in a while.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("a", encoding="utf-8") as handle:
+        for report in reports:
+            handle.write(json.dumps(report, separators=(",", ":")) + "\n")
+        size = handle.tell()
+    if size > max_bytes:
+        _trim_history(path, max_runs, max_bytes // 2)
+
+
+def _trim_history(path: Path, max_runs: int, max_bytes: int) -> None:
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return
+    kept: list[str] = []
+    runs: Counter[str] = Counter()
+    size = 0
+    for line in reversed(lines):
+        try:
+            output = json.loads(line)["output"]
+        except (ValueError, TypeError, KeyError):
+            continue
+        size += len(line) + 1
+        if size > max_bytes:
+            break
+        runs[output] += 1
+        if runs[output] <= max_runs:
+            kept.append(line)
+    tmp_path = _temp_sibling(path)
+    tmp_path.write_text("".join(line + "\n" for line in reversed(kept)), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def read_history(path: Path = HISTORY_PATH) -> list[dict]:
+    """Reports from the history file, oldest first; unreadable lines are skipped."""
+    try:
+        lines = path.read_text(encoding="utf-8").splitlines()
+    except OSError:
+        return []
+    reports = []
+    for line in lines:
+        try:
+            reports.append(json.loads(line))
+        except ValueError:
+            continue
+    return reports
+
+
+def _change(before: float, after: float, unit: str = "") -> str:
+    delta = after - before
+    digits = 1 if unit else 0
+    percent = f" ({delta / before * 100:+.1f}%)" if before else ""
+    return f"{before:,.{digits}f}{unit} -> {after:,.{digits}f}{unit}  {delta:+,.{digits}f}{unit}{percent}"
+
+
+def compare_reports(before: dict, after: dict, top: int = 10) -> list[str]:
+    """Describe how bundle size and build time moved between two reports."""
+    lines = [f"{before['timestamp']} -> {after['timestamp']}  {after['output']}"]
+    for key, label, unit in (
+        ("bytes", "Bytes", ""),
+        ("chars", "Chars", ""),
+        ("tokens", "Tokens", ""),
+        ("files", "Files", ""),
+        ("wall_ms", "Wall time", " ms"),
+        ("load_ms", "Load time", " ms"),
+        ("filter_ms", "Filter time", " ms"),
+    ):
+        lines.append(f"  {label:<12} {_change(before['totals'][key], after['totals'][key], unit)}")
+
+    old = {item["path"]: item["bytes"] for item in before["files"]}
+    new = {item["path"]: item["bytes"] for item in after["files"]}
+    changes = sorted(
+        ((new.get(rel_path, 0) - old.get(rel_path, 0), rel_path) for rel_path in old.keys() | new.keys()),
+        key=lambda item: -abs(item[0]),
+    )
+    changes = [(delta, rel_path) for delta, rel_path in changes if delta][:top]
+    if changes:
+        lines.append("  Largest per-file changes (bytes):")
+        for delta, rel_path in changes:
+            note = " (new)" if rel_path not in old else " (removed)" if rel_path not in new else ""
+            lines.append(f"    {delta:+9,}  {rel_path}{note}")
+    return lines
+
+
+def summarize_report(report: dict, top: int = 10) -> list[str]:
+    """Describe a recorded build report: totals, destinations and the largest files."""
+    totals = report["totals"]
+    name = f"[{report['target']}] " if report.get("target") else ""
+    lines = [
+        f"{name}{report['output']}  built {report['timestamp']} in {totals['wall_ms']:,.0f} ms",
+        f"  {_plural(totals['files'], 'section')}, {totals['chars']:,} chars, {totals['bytes']:,} bytes, ~{totals['tokens']:,} tokens",
+        f"  {totals.get('lines', 0):,} of {totals.get('source_lines', 0):,} source lines kept; filtering removed"
+        f" {totals.get('filtered_chars', 0):,} chars ({totals.get('stripped_comment_chars', 0):,} in comments)",
+    ]
+    if totals.get("tables"):
+        lines.append(f"  collapsed {_plural(totals['tables'], 'table')}, saving {totals['table_bytes_saved']:,} bytes")
+    if totals["cache_hits"] is not None:
+        lines.append(f"  cache: {totals['cache_hits']:,} hits, {totals['cache_misses']:,} misses")
+    for destination in report["destinations"]:
+        detail = f" ({destination['detail']})" if destination["detail"] else ""
+        lines.append(f"  {destination['status']:<9}  {destination['path']}{detail}")
+    largest = sorted(report["files"], key=lambda item: -item["bytes"])[:top]
+    if largest:
+        lines.append("  Largest sections (bytes):")
+        lines.extend(f"    {item['bytes']:>9,}  {item['path']}" for item in largest)
+    return lines
+
 
 def _print_report(path: Path, total_chars: int, comment_chars: int, total_bytes: int,
-                  per_file_stats: list[tuple[str, int, int]]) -> None:
+                  per_file_stats: list[FileStats],
+                  cache: ContentCache | None = None,
+                  resolver: SourceResolver | None = None,
+                  destinations: Sequence[DestinationStatus] = (),
+                  pipeline: PipelineStats | None = None) -> None:
     comment_percent = (comment_chars / total_chars * 100) if total_chars else 0.0
     total_kb = total_bytes / 1024
     print(f"Wrote concatenated file to {path}")
+    for destination in destinations:
+        detail = f" ({destination.detail})" if destination.detail else ""
+        print(f"    {destination.status:<9}  {destination.path}{detail}")
     print("Per-file character totals:")
     max_filename_len = max(
-        (len(Path(rel_path).name) for rel_path, _, _ in per_file_stats), default=0
+        (len(Path(stat.rel_path).name) for stat in per_file_stats), default=0
     )
     max_dir_len = max(
-        (len(str(Path(rel_path).parent)) for rel_path, _, _ in per_file_stats), default=0
+        (len(str(Path(stat.rel_path).parent)) for stat in per_file_stats), default=0
     )
-    for rel_path, char_count, byte_count in per_file_stats:
-        kb = byte_count / 1024
-        percent = (char_count / total_chars * 100) if total_chars else 0.0
-        filename = Path(rel_path).name
-        directory = str(Path(rel_path).parent)
+    for stat in per_file_stats:
+        kb = stat.bytes / 1024
+        percent = (stat.chars / total_chars * 100) if total_chars else 0.0
+        filename = Path(stat.rel_path).name
+        directory = str(Path(stat.rel_path).parent)
+        load_ms = (stat.resolve_seconds + stat.load_seconds) * 1000
+        filter_ms = stat.filter_seconds * 1000
+        shrink = (stat.filtered_chars / stat.source_chars * 100) if stat.source_chars else 0.0
         print(
-            f"  {percent:6.2f}%  {kb:7.2f} KB  {filename:<{max_filename_len}}  {directory:<{max_dir_len}}"
+            f"  {percent:6.2f}%  {kb:7.2f} KB  load {load_ms:7.2f} ms  filter {filter_ms:7.2f} ms"
+            f"  comments -{shrink:5.1f}%  {filename:<{max_filename_len}}  {directory:<{max_dir_len}}"
         )
     print()
     print(f"Total characters in output: {total_chars:,} ({total_kb:,.2f} KB)")
     print(f"Commented character count: {comment_chars:,} ({comment_percent:,.2f}%)")
+    source_chars = sum(stat.source_chars for stat in per_file_stats)
+    filtered_chars = sum(stat.filtered_chars for stat in per_file_stats)
+    stripped_chars = sum(stat.stripped_comment_chars for stat in per_file_stats)
+    removed_lines = sum(stat.source_lines - stat.lines for stat in per_file_stats)
+    filtered_percent = (filtered_chars / source_chars * 100) if source_chars else 0.0
+    print(
+        f"Comment filtering removed {filtered_chars:,} characters ({filtered_percent:,.2f}%),"
+        f" {stripped_chars:,} of them in comments, and {removed_lines:,} lines"
+    )
+    load_ms = sum(stat.resolve_seconds + stat.load_seconds for stat in per_file_stats) * 1000
+    filter_ms = sum(stat.filter_seconds for stat in per_file_stats) * 1000
+    print(f"Summed per-file time: load {load_ms:,.2f} ms, filter {filter_ms:,.2f} ms")
+    if pipeline is not None and pipeline.stages:
+        peak_mb = pipeline.peak_bytes / 1024 / 1024
+        print(f"Pipeline stages (peak {peak_mb:,.2f} MB held of a {pipeline.memory_cap / 1024 / 1024:,.0f} MB cap):")
+        for stage in pipeline.stages:
+            print(
+                f"    {stage.name:<8} x{stage.workers:<3} busy {stage.busy_seconds * 1000:9.2f} ms"
+                f"  starved {stage.starved_seconds * 1000:9.2f} ms  blocked {stage.blocked_seconds * 1000:9.2f} ms"
+                f"  max queue {stage.max_queue}"
+            )
+    total_tokens = sum(stat.tokens for stat in per_file_stats)
+    print(f"Estimated tokens: {total_tokens:,}")
+    cut = [stat for stat in per_file_stats if stat.cut_tokens]
+    if cut:
+        print(f"Cut to fit the token budget ({sum(stat.cut_tokens for stat in cut):,} tokens):")
+        for stat in cut:
+            action = "dropped" if not stat.tokens else f"truncated to {stat.tokens:,} tokens"
+            print(f"    {stat.rel_path}: {action} ({stat.tokens + stat.cut_tokens:,} tokens in full)")
+    duplicates = [stat for stat in per_file_stats if stat.duplicate_of]
+    if duplicates:
+        saved_kb = sum(stat.saved_bytes for stat in duplicates) / 1024
+        print(f"Deduplicated {_plural(len(duplicates), 'section')}, saving {saved_kb:,.2f} KB:")
+        for stat in duplicates:
+            print(f"    {stat.rel_path} -> {stat.duplicate_of}")
+    collapsed = [stat for stat in per_file_stats if stat.tables]
+    if collapsed:
+        saved_kb = sum(stat.table_bytes_saved for stat in collapsed) / 1024
+        print(f"Collapsed {_plural(sum(stat.tables for stat in collapsed), 'table')}, saving {saved_kb:,.2f} KB:")
+        for stat in collapsed:
+            print(f"    {stat.rel_path}: {_plural(stat.tables, 'table')}, {stat.table_bytes_saved:,} bytes saved")
+    if cache is not None:
+        print(f"Content cache: {cache.hits:,} hits, {cache.misses:,} misses")
+    if resolver is not None:
+        # The resolver records ambiguity by looked-up path, without structure: or ::symbols.
+        lookups = [(stat.rel_path, entry_lookup_path(stat.rel_path)) for stat in per_file_stats]
+        ambiguous = [(rel_path, resolver.ambiguous[lookup]) for rel_path, lookup in lookups if lookup in resolver.ambiguous]
+        for rel_path, candidates in ambiguous:
+            print(f"Ambiguous entry '{rel_path}' (using the first match):")
+            for candidate in candidates:
+                print(f"    {candidate}")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""A long-running build process that thin clients hand their command lines to.
+
+`concat_sources.py serve` keeps the library imported and its caches loaded and
+listens on a Unix socket; `concat_sources.py build --server ...` sends its
+arguments there and prints what the build printed, so a rebuild skips the
+interpreter start, the imports and the cache loads. Each connection carries one
+JSON request line, {"argv": [...], "cwd": ...} or {"stop": true}, answered by
+one JSON line {"code": ..., "stdout": ..., "stderr": ...}.
+"""
+from __future__ import annotations
+
+import io
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+from collections.abc import Callable
+from contextlib import redirect_stderr, redirect_stdout
+
+
+SOCKET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "server.sock")
+
+
+def _send(connection: socket.socket, message: dict) -> None:
+    connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def _receive(connection: socket.socket) -> dict | None:
+    with connection.makefile("rb") as reader:
+        line = reader.readline()
+    return json.loads(line) if line else None
+
+
+def _connect(path: str) -> socket.socket | None:
+    try:
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    except (AttributeError, OSError):
+        return None
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+    return client
+
+
+def request(argv: list[str], path: str = SOCKET_PATH) -> int | None:
+    """Run argv on the server, echoing its output; None if no server answered."""
+    client = _connect(path)
+    if client is None:
+        return None
+    with client:
+        _send(client, {"argv": argv, "cwd": os.getcwd()})
+        try:
+            reply = _receive(client)
+        except ValueError:
+            reply = None
+    if reply is None:
+        return None
+    sys.stdout.write(reply["stdout"])
+    sys.stderr.write(reply["stderr"])
+    return reply["code"]
+
+
+def stop(path: str = SOCKET_PATH) -> bool:
+    client = _connect(path)
+    if client is None:
+        print(f"No server is listening on {path}", file=sys.stderr)
+        return False
+    with client:
+        _send(client, {"stop": True})
+        _receive(client)
+    return True
+
+
+def _run(handle: Callable[[list[str]], int], argv: list[str], cwd: str | None) -> int:
+    home = os.getcwd()
+    try:
+        if cwd:
+            os.chdir(cwd)  # relative paths in argv are the client's
+        return handle(argv) or 0
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            return error.code or 0
+        print(error.code, file=sys.stderr)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    finally:
+        os.chdir(home)
+
+
+def serve(handle: Callable[[list[str]], int], path: str = SOCKET_PATH, stale: Callable[[], bool] | None = None) -> int | None:
+    """Answer requests one at a time with handle(argv) until stopped or interrupted.
+
+    stale, if given, is asked before each request; once it returns True the
+    request is left unanswered, so the client builds for itself, and serve
+    returns None for the caller to restart.
+    """
+    client = _connect(path)
+    if client is not None:
+        client.close()
+        print(f"A server is already listening on {path}", file=sys.stderr)
+        return 1
+    if os.path.exists(path):
+        os.remove(path)  # left behind by a server that did not shut down cleanly
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(f"Serving builds on {path}; Ctrl-C or `serve --stop` to stop.", flush=True)
+    restart = False
+    try:
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                try:
+                    message = _receive(connection)
+                except ValueError:
+                    message = None
+                if not isinstance(message, dict):
+                    continue
+                if message.get("stop"):
+                    _send(connection, {"code": 0, "stdout": "", "stderr": ""})
+                    break
+                if stale is not None and stale():
+                    restart = True
+                    break
+                argv = [str(arg) for arg in message.get("argv", [])]
+                started = time.perf_counter()
+                stdout, stderr = io.StringIO(), io.StringIO()
+                with redirect_stdout(stdout), redirect_stderr(stderr):
+                    code = _run(handle, argv, message.get("cwd"))
+                try:
+                    _send(connection, {"code": code, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()})
+                except OSError:
+                    pass  # the client gave up waiting
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                print(f"{time.strftime('%H:%M:%S')} {' '.join(argv) or 'build'} -> {code} in {elapsed_ms:.0f} ms", flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return None if restart else 0
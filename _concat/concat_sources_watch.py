@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Watch the manifest's files and directories and rebuild the bundle on change.
+
+On Linux the watcher uses inotify through ctypes; everywhere else (or if inotify
+is unavailable) it falls back to polling stat results.
+"""
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+
+WATCH_DEBOUNCE_SECONDS = 0.1
+WATCH_POLL_INTERVAL_SECONDS = 0.25
+
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_ISDIR = 0x40000000
+_IN_WATCH_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO
+    | _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF
+)
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    """inotify watches on the parents of watched files and on every watched directory.
+
+    Files are watched through their parent directory so editors that save by
+    writing a new file and renaming it over the old one are still seen.
+    """
+
+    def __init__(self, paths: Iterable[Path]) -> None:
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        # wd -> (directory, {file name: watched path}, owning directory entry or None)
+        self._watches: dict[int, tuple[str, dict[str, Path], Path | None]] = {}
+        self._by_directory: dict[str, int] = {}
+        for path in paths:
+            if path.is_dir():
+                self._watch_tree(path)
+            else:
+                self._watch_file(path)
+
+    def _add_watch(self, directory: str, owner: Path | None) -> int | None:
+        wd = self._by_directory.get(directory)
+        if wd is not None:
+            return wd
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_WATCH_MASK)
+        if wd < 0:
+            return None
+        self._watches[wd] = (directory, {}, owner)
+        self._by_directory[directory] = wd
+        return wd
+
+    def _watch_file(self, path: Path) -> None:
+        wd = self._add_watch(str(path.parent), None)
+        if wd is not None:
+            self._watches[wd][1][path.name] = path
+
+    def _watch_tree(self, root: Path, owner: Path | None = None) -> None:
+        owner = owner or root
+        self._add_watch(str(root), owner)
+        for current, dirnames, _ in os.walk(root):
+            for dirname in dirnames:
+                self._add_watch(os.path.join(current, dirname), owner)
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        """Block until something changes (or timeout passes) and return what changed."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed: set[Path] = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset : offset + name_len].rstrip(b"\0").decode(errors="surrogateescape")
+            offset += name_len
+            watch = self._watches.get(wd)
+            if watch is None:
+                continue
+            directory, files, owner = watch
+            if owner is not None:
+                changed.add(owner)
+                if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                    self._watch_tree(Path(directory) / name, owner)
+            elif name in files:
+                changed.add(files[name])
+        return changed
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class PollingWatcher:
+    """Portable fallback that compares stat snapshots every interval."""
+
+    def __init__(self, paths: Iterable[Path], interval: float = WATCH_POLL_INTERVAL_SECONDS) -> None:
+        self.interval = interval
+        self._paths = list(paths)
+        self._snapshots = {path: self._snapshot(path) for path in self._paths}
+
+    @staticmethod
+    def _snapshot(path: Path) -> object:
+        try:
+            if not path.is_dir():
+                stat = path.stat()
+                return stat.st_mtime_ns, stat.st_size
+            state = []
+            for current, _, filenames in os.walk(path):
+                state.append((current, os.stat(current).st_mtime_ns))
+                for filename in filenames:
+                    stat = os.stat(os.path.join(current, filename))
+                    state.append((filename, stat.st_mtime_ns, stat.st_size))
+            return tuple(state)
+        except OSError:
+            return None
+
+    def wait(self, timeout: float | None = None) -> set[Path]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self._paths:
+                snapshot = self._snapshot(path)
+                if snapshot != self._snapshots[path]:
+                    self._snapshots[path] = snapshot
+                    changed.add(path)
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            pause = self.interval
+            if deadline is not None:
+                pause = min(pause, max(deadline - time.monotonic(), 0.0))
+            time.sleep(pause)
+
+    def close(self) -> None:
+        pass
+
+
+def make_watcher(paths: Iterable[Path], polling: bool = False) -> InotifyWatcher | PollingWatcher:
+    paths = list(paths)
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(paths)
+
+
+def watch(
+    paths: Iterable[Path],
+    rebuild: Callable[[set[Path]], None],
+    debounce: float = WATCH_DEBOUNCE_SECONDS,
+    polling: bool = False,
+) -> None:
+    """Call rebuild with the changed paths after each burst of changes, until interrupted.
+
+    A burst ends once nothing further has changed for `debounce` seconds.
+    """
+    paths = list(paths)
+    watcher = make_watcher(paths, polling)
+    print(f"Watching {len(paths)} paths with {type(watcher).__name__}; Ctrl-C to stop.")
+    try:
+        while True:
+            changed = watcher.wait()
+            while True:
+                more = watcher.wait(debounce)
+                if not more:
+                    break
+                changed |= more
+            if changed:
+                rebuild(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import ArchiveWriter, BundleArchive
+
+SECTIONS = [
+    ("Sources/A.swift", "struct A {}\n"),
+    ("Sources/B.swift", "let b = \"é ✓\"\n" * 200),
+    ("Sources/Empty.swift", ""),
+]
+
+
+def test_archive_round_trip(tmp_path: Path) -> None:
+    path = tmp_path / "bundle.cgz"
+    with ArchiveWriter(path) as writer:
+        for rel_path, section in SECTIONS:
+            writer.add(rel_path, section)
+
+    with BundleArchive(path) as archive:
+        members_end = sum(entry["length"] for entry in archive.sections)
+        assert archive.paths() == [rel_path for rel_path, _ in SECTIONS]
+        for rel_path, section in reversed(SECTIONS):
+            assert archive.section(rel_path) == section
+            entry = archive.entry(rel_path)
+            assert entry["chars"] == len(section)
+            assert entry["sha256"] == hashlib.sha256(section.encode("utf-8")).hexdigest()
+        with pytest.raises(KeyError):
+            archive.section("Sources/Missing.swift")
+
+    # The members are plain gzip, so a stock reader sees every section in order.
+    members = gzip.decompress(path.read_bytes()[:members_end])
+    assert members.decode("utf-8") == "".join(section for _, section in SECTIONS)
+
+
+def test_failed_write_leaves_no_archive(tmp_path: Path) -> None:
+    path = tmp_path / "bundle.cgz"
+    with pytest.raises(RuntimeError):
+        with ArchiveWriter(path) as writer:
+            writer.add("Sources/A.swift", "struct A {}\n")
+            raise RuntimeError
+    assert not list(tmp_path.iterdir())
+
+
+def test_rejects_other_files(tmp_path: Path) -> None:
+    path = tmp_path / "bundle.txt"
+    path.write_bytes(b"not an archive, but long enough to hold a trailer")
+    with pytest.raises(ValueError):
+        BundleArchive(path)
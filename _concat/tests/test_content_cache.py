@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import ContentCache, FilterStats
+
+
+class CountingFilter:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def __call__(self, text: str, stats: FilterStats | None) -> str:
+        self.calls += 1
+        return text.upper()
+
+
+@pytest.fixture
+def source(tmp_path: Path) -> Path:
+    path = tmp_path / "A.swift"
+    path.write_text("let a = 1\n", encoding="utf-8")
+    return path
+
+
+def load(cache: ContentCache, path: Path, filter_text: CountingFilter) -> str:
+    return cache.load_source_content(path, filter_text=filter_text)
+
+
+def test_unchanged_file_is_served_from_disk_without_rewriting_the_index(tmp_path: Path, source: Path) -> None:
+    index_path = tmp_path / "cache" / "content.json"
+    filter_text = CountingFilter()
+    cache = ContentCache(index_path)
+    assert load(cache, source, filter_text) == "LET A = 1\n"
+    cache.save()
+    saved = index_path.stat().st_mtime_ns
+
+    reloaded = ContentCache(index_path)
+    assert load(reloaded, source, filter_text) == "LET A = 1\n"
+    reloaded.save()
+    assert filter_text.calls == 1
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
+    assert index_path.stat().st_mtime_ns == saved
+    assert [path.name for path in reloaded.bodies.iterdir()] == [f"{reloaded.entries[str(source.resolve())]['content_sha256']}.txt"]
+
+
+def test_touched_file_with_same_contents_is_a_hit(source: Path, tmp_path: Path) -> None:
+    filter_text = CountingFilter()
+    cache = ContentCache(tmp_path / "content.json")
+    load(cache, source, filter_text)
+    stat = source.stat()
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load(cache, source, filter_text) == "LET A = 1\n"
+    assert filter_text.calls == 1
+    assert cache.entries[str(source.resolve())]["mtime_ns"] == stat.st_mtime_ns + 10**9
+
+
+def test_changed_size_is_a_miss(source: Path, tmp_path: Path) -> None:
+    filter_text = CountingFilter()
+    cache = ContentCache(tmp_path / "content.json")
+    load(cache, source, filter_text)
+    mtime_ns = source.stat().st_mtime_ns
+    source.write_text("let a = 12\n", encoding="utf-8")
+    os.utime(source, ns=(mtime_ns, mtime_ns))
+    assert load(cache, source, filter_text) == "LET A = 12\n"
+    assert filter_text.calls == 2
+
+
+def test_changed_contents_of_the_same_size_are_a_miss(source: Path, tmp_path: Path) -> None:
+    filter_text = CountingFilter()
+    cache = ContentCache(tmp_path / "content.json")
+    load(cache, source, filter_text)
+    stat = source.stat()
+    source.write_text("let b = 2\n", encoding="utf-8")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert load(cache, source, filter_text) == "LET B = 2\n"
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_missing_body_is_a_miss(source: Path, tmp_path: Path) -> None:
+    filter_text = CountingFilter()
+    cache = ContentCache(tmp_path / "content.json")
+    load(cache, source, filter_text)
+    for body in cache.bodies.iterdir():
+        body.unlink()
+    assert load(cache, source, filter_text) == "LET A = 1\n"
+    assert filter_text.calls == 2
+
+
+def test_prune_keeps_listed_entries_and_deletes_orphaned_bodies(tmp_path: Path) -> None:
+    paths = {name: tmp_path / f"{name}.swift" for name in ("kept", "listed", "copy", "dropped")}
+    for name, path in paths.items():
+        path.write_text("let shared = 0\n" if name in ("copy", "dropped") else f"let {name} = 0\n", encoding="utf-8")
+    filter_text = CountingFilter()
+    index_path = tmp_path / "content.json"
+    cache = ContentCache(index_path)
+    for path in paths.values():
+        load(cache, path, filter_text)
+    cache.save()
+
+    cache = ContentCache(index_path)
+    load(cache, paths["kept"], filter_text)
+    load(cache, paths["copy"], filter_text)
+    assert cache.prune(lambda: [str(paths["listed"].resolve())]) == 1
+    assert set(cache.entries) == {str(paths[name].resolve()) for name in ("kept", "listed", "copy")}
+    # "dropped" shared its body with "copy", so no body goes.
+    assert len(list(cache.bodies.iterdir())) == 3
+
+    cache = ContentCache(index_path)
+    load(cache, paths["kept"], filter_text)
+    assert cache.prune() == 3
+    assert list(cache.entries) == [str(paths["kept"].resolve())]
+    assert len(list(cache.bodies.iterdir())) == 1
+
+
+def test_prune_drops_least_recently_used_beyond_the_bounds(tmp_path: Path) -> None:
+    filter_text = CountingFilter()
+    cache = ContentCache(tmp_path / "content.json", max_entries=2)
+    paths = [tmp_path / f"{index}.swift" for index in range(3)]
+    for index, path in enumerate(paths):
+        path.write_text(f"let x{index} = 0\n", encoding="utf-8")
+        load(cache, path, filter_text)
+        cache.entries[str(path.resolve())]["last_used"] = index
+    assert cache.prune() == 1
+    assert set(cache.entries) == {str(path.resolve()) for path in paths[1:]}
+    assert len(list(cache.bodies.iterdir())) == 2
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import os
+import time
+from pathlib import Path
+
+import pytest
+
+import concat_sources_fingerprint as fingerprint
+
+
+@pytest.fixture
+def files(tmp_path: Path) -> tuple[Path, Path, str]:
+    source = tmp_path / "A.swift"
+    source.write_text("let a = 1\n", encoding="utf-8")
+    output = tmp_path / "bundle.txt"
+    output.write_text("bundle\n", encoding="utf-8")
+    # Inputs written before the build started, as they would be.
+    past = time.time_ns() - 10**10
+    os.utime(source, ns=(past, past))
+    return source, output, str(tmp_path / "fingerprints.json")
+
+
+def test_unchanged_build_is_current(files: tuple[Path, Path, str]) -> None:
+    source, output, store = files
+    fingerprint.record("key", [str(source)], [str(output)], time.time(), store)
+    build = fingerprint.is_current("key", store)
+    assert build is not None
+    assert set(build["paths"]) == {str(source), str(output)}
+    assert fingerprint.is_current("other", store) is None
+
+
+@pytest.mark.parametrize("changed", ["input", "output", "missing"])
+def test_changed_paths_are_not_current(files: tuple[Path, Path, str], changed: str) -> None:
+    source, output, store = files
+    fingerprint.record("key", [str(source)], [str(output)], time.time(), store)
+    if changed == "input":
+        source.write_text("let a = 22\n", encoding="utf-8")
+    elif changed == "output":
+        output.write_text("edited bundle\n", encoding="utf-8")
+    else:
+        output.unlink()
+    assert fingerprint.is_current("key", store) is None
+
+
+def test_input_modified_during_the_build_is_recorded_as_changed(files: tuple[Path, Path, str]) -> None:
+    source, output, store = files
+    started = time.time()
+    os.utime(source, ns=(time.time_ns() + 10**9,) * 2)
+    fingerprint.record("key", [str(source)], [str(output)], started, store)
+    assert fingerprint.is_current("key", store) is None
+
+
+def test_only_the_latest_builds_are_kept(files: tuple[Path, Path, str]) -> None:
+    source, output, store = files
+    for index in range(fingerprint.FINGERPRINT_MAX_BUILDS + 2):
+        fingerprint.record(f"key{index}", [str(source)], [str(output)], time.time(), store)
+    assert fingerprint.is_current("key0", store) is None
+    assert fingerprint.is_current("key1", store) is None
+    assert fingerprint.is_current("key2", store) is not None
+
+
+def test_build_key() -> None:
+    assert fingerprint.build_key(["--jobs", "4"]) == fingerprint.build_key(["--server", "--jobs", "4"])
+    assert fingerprint.build_key(["--jobs", "4"]) != fingerprint.build_key(["--jobs", "2"])
+    assert fingerprint.build_key(["--force"]) is None
+    assert fingerprint.build_key(["--since=HEAD~1"]) is None
+    assert fingerprint.build_key(["--format", "json"]) is None
+    assert fingerprint.build_key(["--format=text"]) is not None
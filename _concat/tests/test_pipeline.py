@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import time
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import PipelineStats, ResolvedEntry, iter_staged
+
+ITEMS = [f"item{index}" for index in range(40)]
+
+
+def resolve(size: int):
+    return lambda item: ResolvedEntry(item, Path(item), None, 0.0, size)
+
+
+def slow_upper(entry: ResolvedEntry) -> str:
+    # Later items finish first, so results only come out in order if they are put back.
+    time.sleep(0.001 * (len(ITEMS) - int(entry.rel_path[4:])) / len(ITEMS))
+    return entry.rel_path.upper()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_results_keep_input_order(workers: int) -> None:
+    results = list(iter_staged(ITEMS, [("resolve", resolve(10), 1), ("work", slow_upper, workers)]))
+    assert results == [item.upper() for item in ITEMS]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_error_is_raised_when_its_item_comes_up(workers: int) -> None:
+    def work(entry: ResolvedEntry) -> str:
+        if entry.rel_path == "item7":
+            raise ValueError("bad item")
+        return entry.rel_path
+
+    results = iter_staged(ITEMS, [("resolve", resolve(10), 1), ("work", work, workers)])
+    assert [next(results) for _ in range(7)] == ITEMS[:7]
+    with pytest.raises(ValueError, match="bad item"):
+        next(results)
+
+
+def test_held_bytes_stay_under_the_cap() -> None:
+    stats = PipelineStats()
+    results = list(iter_staged(ITEMS, [("resolve", resolve(100), 1), ("work", slow_upper, 4)], memory_cap=250, stats=stats))
+    assert len(results) == len(ITEMS)
+    assert stats.memory_cap == 250
+    assert 0 < stats.peak_bytes <= 250
+
+
+def test_entry_larger_than_the_cap_runs_alone() -> None:
+    stats = PipelineStats()
+    results = list(iter_staged(ITEMS, [("resolve", resolve(100), 1), ("work", slow_upper, 4)], memory_cap=50, stats=stats))
+    assert len(results) == len(ITEMS)
+    assert stats.peak_bytes == 100
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import changed_since
+
+pytestmark = pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+
+ENTRIES = ["Sources/A.swift", "Sources/B.swift", "Other", "Sources/New.swift"]
+
+
+def git(repo: Path, *args: str) -> None:
+    subprocess.run(["git", *args], cwd=repo, check=True, capture_output=True)
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    (repo / "Sources").mkdir(parents=True)
+    (repo / "Other").mkdir()
+    (repo / "Sources/A.swift").write_text("let a = 1\n", encoding="utf-8")
+    (repo / "Sources/B.swift").write_text("let b = 1\n", encoding="utf-8")
+    (repo / "Other/C.swift").write_text("let c = 1\n", encoding="utf-8")
+    git(repo, "init", "-q")
+    git(repo, "add", ".")
+    git(repo, "-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "base")
+    return repo
+
+
+def test_nothing_changed(repo: Path) -> None:
+    assert changed_since(repo, ENTRIES[:3], "HEAD") == ([], {})
+
+
+def test_modified_untracked_and_directory_entries(repo: Path) -> None:
+    (repo / "Sources/A.swift").write_text("let a = 2\n", encoding="utf-8")
+    (repo / "Sources/New.swift").write_text("let n = 1\n", encoding="utf-8")
+    (repo / "Other/C.swift").write_text("let c = 2\n", encoding="utf-8")
+    selected, diffs = changed_since(repo, ENTRIES, "HEAD")
+    assert selected == ["Sources/A.swift", "Other", "Sources/New.swift"]
+    assert diffs == {}
+
+
+def test_diffs_only_for_tracked_files(repo: Path) -> None:
+    (repo / "Sources/A.swift").write_text("let a = 2\n", encoding="utf-8")
+    (repo / "Sources/New.swift").write_text("let n = 1\n", encoding="utf-8")
+    selected, diffs = changed_since(repo, ENTRIES, "HEAD", with_diffs=True)
+    assert selected == ["Sources/A.swift", "Sources/New.swift"]
+    assert list(diffs) == ["Sources/A.swift"]
+    assert "-let a = 1\n+let a = 2" in diffs["Sources/A.swift"]
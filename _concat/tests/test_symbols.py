@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import SymbolIndex, scan_swift_declarations
+
+SOURCE = '''import Foundation
+
+/// A shape.
+protocol Shape {
+    var area: Double { get }
+    func scaled(by factor: Double) -> Self
+}
+
+struct Outer {
+    struct Inner {
+        func run() {
+            func local() {}
+            local()
+        }
+    }
+
+    let value = "func fake() {"
+}
+
+extension Outer: Equatable where Value: Equatable {
+    @inlinable
+    static func == (lhs: Outer, rhs: Outer) -> Bool { true }
+}
+
+extension Array where Element: Shape {
+    func totalArea() -> Double { 0 }
+}
+'''
+
+
+def declared(name: str) -> list[str]:
+    return [SOURCE[start:end] for start, end in scan_swift_declarations(SOURCE)[name]]
+
+
+def test_protocol_and_its_requirements() -> None:
+    assert declared("Shape") == [SOURCE[SOURCE.index("/// A shape.") : SOURCE.index("\n\nstruct Outer")]]
+    assert declared("Shape.scaled") == ["    func scaled(by factor: Double) -> Self"]
+
+
+def test_nested_types_are_qualified() -> None:
+    assert declared("Outer.Inner") == declared("Inner")
+    assert declared("Outer.Inner.run")[0].startswith("        func run() {")
+    assert declared("Outer.Inner.run")[0].endswith("local()\n        }")
+
+
+def test_local_functions_and_strings_are_not_declarations() -> None:
+    index = scan_swift_declarations(SOURCE)
+    assert "local" not in index
+    assert "fake" not in index
+
+
+def test_extensions_with_where_clauses_join_their_type() -> None:
+    outer = declared("Outer")
+    assert len(outer) == 2
+    assert outer[1].startswith("extension Outer: Equatable where Value: Equatable {")
+    assert declared("Outer.==") == ["    @inlinable\n    static func == (lhs: Outer, rhs: Outer) -> Bool { true }"]
+    assert declared("Array.totalArea") == ["    func totalArea() -> Double { 0 }"]
+
+
+def test_extract_joins_selected_declarations_in_file_order(tmp_path: Path) -> None:
+    path = tmp_path / "Shapes.swift"
+    path.write_text(SOURCE, encoding="utf-8")
+    symbols = SymbolIndex(None)
+    extracted = symbols.extract(path, ["Array.totalArea", "Shape"])
+    assert extracted == "\n\n".join(declared("Shape") + declared("Array.totalArea"))
+    # A member inside a selected type is not repeated.
+    assert symbols.extract(path, ["Outer", "Outer.Inner.run"]) == "\n\n".join(declared("Outer"))
+    assert symbols.scans == 1
+
+
+def test_extract_names_what_is_declared(tmp_path: Path) -> None:
+    path = tmp_path / "Shapes.swift"
+    path.write_text(SOURCE, encoding="utf-8")
+    with pytest.raises(ValueError, match=r"'Missing' is not declared .*Outer"):
+        SymbolIndex(None).extract(path, ["Missing"])
+
+
+def test_index_is_saved_and_reloaded(tmp_path: Path) -> None:
+    path = tmp_path / "Shapes.swift"
+    path.write_text(SOURCE, encoding="utf-8")
+    index_path = tmp_path / "symbols.json"
+    symbols = SymbolIndex(index_path)
+    symbols.extract(path, ["Shape"])
+    symbols.save()
+    reloaded = SymbolIndex(index_path)
+    assert reloaded.extract(path, ["Shape"]) == declared("Shape")[0]
+    assert reloaded.scans == 0
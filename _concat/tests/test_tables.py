@@ -0,0 +1,47 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from concat_sources_lib import LoadStats, TableStore, collapse_tables, expand_tables
+
+
+def _source() -> str:
+    rows = "\n".join(f'    ("name{index}", {index}, "a // b"),' for index in range(40))
+    lookup = ", ".join(f'"k{index}": {index}' for index in range(40))
+    return (
+        "// Header\n"
+        f"let table: [(String, Int, String)] = [\n{rows}\n]\n"
+        f"let lookup = [{lookup}]\n"
+        'let small = [1, 2, 3]\n'
+        "let closures = [" + ", ".join("{ $0 + 1 }" for _ in range(40)) + "]\n"
+    )
+
+
+def test_collapse_expand_round_trip(tmp_path: Path) -> None:
+    source = _source()
+    store = TableStore(tmp_path)
+    stats = LoadStats()
+    collapsed = collapse_tables(source, stats, store, min_items=10, min_bytes=100)
+    assert stats.tables == 2
+    assert stats.table_bytes_saved == len(source.encode("utf-8")) - len(collapsed.encode("utf-8"))
+    assert "items, " in collapsed and "let small = [1, 2, 3]" in collapsed
+    assert "{ $0 + 1 }" in collapsed
+    assert expand_tables(collapsed, store) == (source, [])
+
+
+def test_collapse_is_a_no_op_below_the_thresholds(tmp_path: Path) -> None:
+    source = _source()
+    assert collapse_tables(source, store=TableStore(tmp_path), min_items=1000) == source
+    assert not list(tmp_path.iterdir())
+
+
+def test_expand_reports_missing_and_edited_summaries(tmp_path: Path) -> None:
+    collapsed = collapse_tables(_source(), store=TableStore(tmp_path), min_items=10, min_bytes=100)
+    text, missing = expand_tables(collapsed, TableStore(tmp_path / "empty"))
+    assert text == collapsed
+    assert len(missing) == 2
+
+    edited = collapsed.replace('"k0": 0', '"renamed": 0', 1)
+    text, missing = expand_tables(edited, TableStore(tmp_path))
+    assert len(missing) == 1
+    assert '"renamed"' in text
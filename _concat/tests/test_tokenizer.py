@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import pytest
+
+from concat_sources_lib import FilterStats, filter_comment_lines, mask_comments_and_strings
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        'let url = "http://example.com" // trailing\n',
+        'let url = "\\(host ?? "http://a")/path" // trailing\n',
+        'let s = "a\\(f("b)") + g(")"))c" // trailing\n',
+        'let s = "\\(a("\\(b("//"))"))" // trailing\n',
+        'let s = #"raw \\#(x ?? "//") done"# // trailing\n',
+        'let s = ##"raw \\#(x) "# still // raw"## // trailing\n',
+        'let s = """\n    \\(items.map { "\\($0)//" }.joined())\n    """ // trailing\n',
+        'let s = "escaped \\" quote // kept" // trailing\n',
+    ],
+)
+def test_comment_after_string_is_stripped(source: str) -> None:
+    code = source[: source.rindex(" // trailing")]
+    assert filter_comment_lines(source) == code + "\n"
+
+
+def test_unterminated_interpolation_stops_at_line_end() -> None:
+    source = 'let s = "\\(broken\n// gone\nlet t = 1\n'
+    assert filter_comment_lines(source) == 'let s = "\\(broken\nlet t = 1\n'
+
+
+def test_comments_inside_interpolation_are_part_of_the_string() -> None:
+    source = 'let s = "\\(a /* ) */ + b)" // trailing\n'
+    assert filter_comment_lines(source) == 'let s = "\\(a /* ) */ + b)"\n'
+
+
+def test_nested_block_comments_and_kept_warnings() -> None:
+    source = "/* outer /* inner */ still */\nlet a = 1 // warning: keep me\n// plain\nlet b = 2\n"
+    assert filter_comment_lines(source) == "let a = 1 // warning: keep me\nlet b = 2\n"
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        'let s = "\\(x ?? "}")" // }\nlet t = 1\n',
+        'let s = """\n  a "quoted" \\(b(")"))\n  """\nlet t = 2 /* { */\n',
+    ],
+)
+def test_mask_keeps_offsets_and_newlines(source: str) -> None:
+    masked = mask_comments_and_strings(source)
+    assert len(masked) == len(source)
+    assert [i for i, char in enumerate(masked) if char == "\n"] == [i for i, char in enumerate(source) if char == "\n"]
+    assert "}" not in masked and "{" not in masked
+    assert "let t" in masked
+
+
+@pytest.mark.parametrize(
+    ("source", "expected"),
+    [
+        ("let x = a/*b*/c\n", "let x = a c\n"),
+        ("let x = a /* b */ c\n", "let x = a c\n"),
+        ("f(a, /* b */c)\n", "f(a, c)\n"),
+        ("    let a = 1 /* x\n y */ let b = 2\n", "    let a = 1\n    let b = 2\n"),
+        ("let a = 1 /* x */\nlet b = 2\n", "let a = 1\nlet b = 2\n"),
+    ],
+)
+def test_removed_block_comment_keeps_code_apart(source: str, expected: str) -> None:
+    stats = FilterStats()
+    assert filter_comment_lines(source, stats) == expected
+    assert stats.code_chars + stats.kept_comment_chars == len(expected)
@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from concat_sources_lib import concatenate_sources_for, verify_bundle
+
+ENTRIES = ["Sources/A.swift", "Sources/B.swift"]
+
+
+@pytest.fixture
+def built(tmp_path: Path) -> tuple[Path, Path, Path]:
+    repo = tmp_path / "repo"
+    (repo / "Sources").mkdir(parents=True)
+    (repo / "Sources/A.swift").write_text("struct A {} // note\n", encoding="utf-8")
+    (repo / "Sources/B.swift").write_text("let b = 1\n", encoding="utf-8")
+    output = tmp_path / "bundle.txt"
+    copy = tmp_path / "copy.txt"
+    concatenate_sources_for(ENTRIES, str(output), copy, repo_root=repo)
+    return repo, output, copy
+
+
+def test_fresh(built: tuple[Path, Path, Path]) -> None:
+    repo, output, copy = built
+    result = verify_bundle(output, repo, ENTRIES)
+    assert result.fresh
+    assert result.sections == 2
+    assert [check.status for check in result.copies] == ["intact", "intact"]
+
+
+def test_touched_source_is_still_fresh(built: tuple[Path, Path, Path]) -> None:
+    repo, output, _ = built
+    source = repo / "Sources/A.swift"
+    source.write_text("struct A {} // another note\n", encoding="utf-8")
+    result = verify_bundle(output, repo, ENTRIES)
+    assert result.fresh
+    assert result.touched == ["Sources/A.swift"]
+    assert result.changed == []
+
+
+def test_changed_source(built: tuple[Path, Path, Path]) -> None:
+    repo, output, _ = built
+    source = repo / "Sources/B.swift"
+    stat = source.stat()
+    source.write_text("let b = 2\n", encoding="utf-8")
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert verify_bundle(output, repo, ENTRIES).fresh  # same size and mtime: not read
+
+    os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    result = verify_bundle(output, repo, ENTRIES)
+    assert not result.fresh
+    assert result.changed == ["Sources/B.swift"]
+
+
+def test_stale_and_missing_copies(built: tuple[Path, Path, Path]) -> None:
+    repo, output, copy = built
+    data = bytearray(copy.read_bytes())
+    data[0] ^= 1
+    copy.write_bytes(bytes(data))
+    result = verify_bundle(output, repo, ENTRIES)
+    assert not result.fresh
+    assert [check.status for check in result.copies] == ["intact", "stale"]
+    assert "Sources/A.swift" in result.copies[1].detail
+
+    copy.write_bytes(bytes(data) + b"\n")
+    assert verify_bundle(output, repo, ENTRIES).copies[1].status == "stale"
+
+    copy.unlink()
+    assert verify_bundle(output, repo, ENTRIES).copies[1].status == "missing"
+
+
+def test_entry_list_changes(built: tuple[Path, Path, Path]) -> None:
+    repo, output, _ = built
+    result = verify_bundle(output, repo, [*ENTRIES, "Sources/C.swift"])
+    assert result.added == ["Sources/C.swift"] and not result.fresh
+
+    result = verify_bundle(output, repo, ENTRIES[:1])
+    assert result.removed == ["Sources/B.swift"] and not result.fresh
+
+    result = verify_bundle(output, repo, ENTRIES[::-1])
+    assert result.reordered and not result.fresh
+
+
+def test_requires_an_integrity_record(tmp_path: Path) -> None:
+    with pytest.raises(ValueError):
+        verify_bundle(tmp_path / "bundle.txt", tmp_path)